@@ -0,0 +1,118 @@
+##                                COPYRIGHT
+##    Copyright (C) 2015 Kyle Briggs (kbrig035<at>uottawa.ca)
+##
+##    This file is part of cusumtools.
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+import numpy as np
+
+
+def pixel_index(values, lo, hi, n):
+    ##bin of each value on an n pixel axis spanning lo to hi, or -1 outside the axis. log axes pass log10 values
+    ##and limits, so that the transform is done once per plot rather than on every re-bin
+    with np.errstate(invalid='ignore'):
+        scaled = (values - lo)*(n/(hi - lo))
+    index = np.full(len(values), -1, dtype=np.int64)
+    inside = (scaled >= 0) & (scaled < n)
+    index[inside] = scaled[inside].astype(np.int64)
+    return index
+
+
+def density_grid(x, y, xlim, ylim, shape):
+    ##counts per screen pixel, rows running bottom to top, from one vectorized bincount
+    height, width = shape
+    ix = pixel_index(x, xlim[0], xlim[1], width)
+    iy = pixel_index(y, ylim[0], ylim[1], height)
+    inside = (ix >= 0) & (iy >= 0)
+    counts = np.bincount(iy[inside]*width + ix[inside], minlength=width*height)
+    return counts.reshape(height, width)
+
+
+def composite(grids, colors):
+    ##RGBA image of several count grids, each drawn in its own color with opacity growing with log(count),
+    ##layered in order with the usual over operator
+    peak = np.log1p(max([grid.max() for grid in grids] + [1]))
+    image = np.zeros(grids[0].shape + (4,))
+    for grid, color in zip(grids, colors):
+        alpha = (np.log1p(grid)/peak)[...,np.newaxis]
+        image[...,:3] = alpha*np.asarray(color[:3]) + (1-alpha)*image[...,:3]
+        image[...,3:] = alpha + (1-alpha)*image[...,3:]
+    return image
+
+
+histogram_cache_entries = 32
+
+
+def shared_edges(columns, bins):
+    ##one set of uniform edges spanning the finite values of every column, as np.histogram would choose for
+    ##their union, so that overlaid subsets are binned identically
+    lo = np.inf
+    hi = -np.inf
+    for col in columns:
+        col = col[np.isfinite(col)]
+        if len(col) > 0:
+            lo = min(lo, np.min(col))
+            hi = max(hi, np.max(col))
+    if lo > hi:
+        lo, hi = 0.0, 1.0
+    elif lo == hi:
+        lo, hi = lo - 0.5, hi + 0.5
+    return np.linspace(lo, hi, bins+1)
+
+
+def bin_index(values, edges):
+    ##bin of each value with the last bin closed on the right like np.histogram, or -1 outside the edges
+    n = len(edges) - 1
+    index = np.full(len(values), -1, dtype=np.int64)
+    with np.errstate(invalid='ignore'):
+        inside = (values >= edges[0]) & (values <= edges[-1])
+    widths = np.diff(edges)
+    if np.allclose(widths, widths[0]):
+        index[inside] = np.minimum(((values[inside] - edges[0])*(n/(edges[-1] - edges[0]))).astype(np.int64), n-1)
+    else:
+        index[inside] = np.minimum(np.searchsorted(edges, values[inside], side='right') - 1, n-1)
+    return index
+
+
+def histogram(values, edges):
+    return np.histogram(values[np.isfinite(values)], edges)[0]
+
+
+def histogram2d(x, y, xedges, yedges):
+    ix = bin_index(x, xedges)
+    iy = bin_index(y, yedges)
+    inside = (ix >= 0) & (iy >= 0)
+    counts = np.bincount(ix[inside]*(len(yedges)-1) + iy[inside], minlength=(len(xedges)-1)*(len(yedges)-1))
+    return counts.reshape(len(xedges)-1, len(yedges)-1)
+
+
+class HistogramCache(object):
+    ##histogram results keyed by everything they depend on, including the column versions of the subsets,
+    ##so redrawing with only a display option changed reuses the counts
+    def __init__(self, max_entries=histogram_cache_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key, compute):
+        result = self.entries.get(key)
+        if result is None:
+            result = compute()
+            self.entries[key] = result
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return result
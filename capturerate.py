@@ -0,0 +1,119 @@
+##                                COPYRIGHT
+##    Copyright (C) 2015 Kyle Briggs (kbrig035<at>uottawa.ca)
+##
+##    This file is part of cusumtools.
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+bootstrap_block_elements = 2**24
+
+
+def delay_mask(db):
+    ##True for delays between two events that were consecutive in the original recording
+    index_diff = np.diff(db.ids())
+    if 'index_ref' in db:
+        return (index_diff - np.diff(db.col('index_ref'))) == 0
+    return index_diff == 1
+
+
+def interevent_delays(db, censor=False):
+    ##returns the valid delays and, if censor is set, the right-censored waiting times cut short by a removed
+    ##event: for a non-consecutive pair we only know no event of this subset arrived before the next event in
+    ##the full recording
+    start_times = db.col('start_time_s')
+    delays = np.diff(start_times)
+    valid = delay_mask(db)
+    if not censor:
+        return delays[valid], np.zeros(0)
+    master_times = db.master['start_time_s'].values
+    rows = db.rows[:-1][~valid]
+    censored = master_times[rows+1] - master_times[rows]
+    return delays[valid], np.clip(censored, 0, delays[~valid])
+
+
+def windowed_capture_rate(db, window, step, censor=False):
+    ##capture rate in sliding windows over the recording. each delay belongs to the window holding the start
+    ##of its first event, and window edges are located with one searchsorted sweep over the sorted start times
+    start_times = db.col('start_time_s')
+    if len(start_times) < 2 or window <= 0 or step <= 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+    times = start_times[:-1]
+    delays = np.diff(start_times)
+    valid = delay_mask(db)
+    exposure = np.where(valid, delays, 0.0)
+    if censor:
+        master_times = db.master['start_time_s'].values
+        rows = db.rows[:-1][~valid]
+        exposure[~valid] = np.clip(master_times[rows+1] - master_times[rows], 0, delays[~valid])
+    cum_exposure = np.concatenate([[0.0], np.cumsum(exposure)])
+    cum_events = np.concatenate([[0], np.cumsum(valid)])
+    window_starts = np.arange(times[0], max(times[-1]-window, times[0]) + 0.5*step, step)
+    first = np.searchsorted(times, window_starts, side='left')
+    last = np.searchsorted(times, window_starts + window, side='left')
+    events = cum_events[last] - cum_events[first]
+    exposure = cum_exposure[last] - cum_exposure[first]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rates = events/exposure
+        errors = rates/np.sqrt(events)
+    return window_starts + 0.5*window, rates, errors, events
+
+
+def mle_rate(delays, censored):
+    ##closed form maximum likelihood rate for exponential waiting times with right censoring
+    exposure = np.sum(delays) + np.sum(censored)
+    return len(delays)/exposure if exposure > 0 else np.nan
+
+
+def capture_rates(groups, num_boot=1000, confidence=0.95, seed=None):
+    ##rates and bootstrap confidence intervals for several (delays, censored) groups in one call.
+    ##each group is resampled as B x N indices in one array operation, split into blocks to bound memory
+    rates = np.array([mle_rate(d, c) for d, c in groups])
+    lower = np.full(len(groups), np.nan)
+    upper = np.full(len(groups), np.nan)
+    rng = np.random.default_rng(seed)
+    tail = 50.0*(1.0-confidence)
+    for i, (delays, censored) in enumerate(groups):
+        if len(delays) == 0 or num_boot < 1:
+            continue
+        times = np.concatenate([delays, censored])
+        size = len(times)
+        boot = np.empty(num_boot)
+        block = max(1, bootstrap_block_elements//size)
+        for b in range(0, num_boot, block):
+            n = min(block, num_boot-b)
+            draws = rng.integers(0, size, size=(n, size))
+            exposure = times[draws].sum(axis=1)
+            if len(censored) > 0:
+                events = (draws < len(delays)).sum(axis=1)
+            else:
+                events = size
+            with np.errstate(invalid='ignore', divide='ignore'):
+                boot[b:b+n] = events/exposure
+        lower[i], upper[i] = np.nanpercentile(boot, [tail, 100.0-tail])
+    return rates, lower, upper
+
+
+def survival(delays, censored):
+    ##Kaplan-Meier survival probability just before each uncensored delay, which reduces to 1 - i/N without censoring
+    times = np.concatenate([delays, censored])
+    observed = np.concatenate([np.ones(len(delays)), np.zeros(len(censored))])
+    order = np.argsort(times, kind='mergesort')
+    times = times[order]
+    observed = observed[order]
+    at_risk = len(times) - np.arange(len(times))
+    probability = np.cumprod(np.concatenate([[1.0], 1.0 - observed[:-1]/at_risk[:-1]])) if len(times) > 0 else np.zeros(0)
+    keep = observed == 1
+    return times[keep], probability[keep]
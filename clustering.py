@@ -0,0 +1,218 @@
+##                                COPYRIGHT
+##    Copyright (C) 2015 Kyle Briggs (kbrig035<at>uottawa.ca)
+##
+##    This file is part of cusumtools.
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import colorsys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+import numpy as np
+import hdbscan
+from hdbscan._hdbscan_tree import condense_tree, compute_stability, get_clusters
+
+feature_cache_entries = 64
+tree_cache_entries = 4
+predict_chunk_size = 50000
+probability_levels = 256
+noise_color = (0.0, 0.0, 0.0, 1.0)
+predict_clusterer = None
+
+
+def signed_log(col):
+    sign = np.sign(np.average(col))
+    return np.log10(sign*col)
+
+
+def normalize(col, norm):
+    if norm == 'None':
+        return col
+    col = col - np.average(col)
+    if norm == 'Max':
+        col /= np.max(np.absolute(col))
+    elif norm == 'Gauss':
+        col /= np.std(col)
+    elif norm == 'MAD':
+        col /= np.median(np.absolute(col - np.average(col)))
+    return col
+
+
+class FeatureCache(object):
+    ##normalized feature columns stored as float32, keyed by (column, log, normalization, column version,
+    ##include baseline) so that only columns that actually changed are rebuilt between clustering runs
+    def __init__(self, max_entries=feature_cache_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def column(self, key, loader):
+        col = self.entries.get(key)
+        if col is not None:
+            self.entries.move_to_end(key)
+            return col
+        name, logscale, norm = key[:3]
+        col = np.squeeze(np.asarray(loader(name), dtype=np.float64))
+        if logscale:
+            col = signed_log(col)
+        col = normalize(col, norm).astype(np.float32)
+        self.entries[key] = col
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return col
+
+    def matrix(self, keys, loader):
+        columns = [self.column(key, loader) for key in keys]
+        data = np.empty((len(columns[0]), len(columns)), dtype=np.float32)
+        for i, col in enumerate(columns):
+            data[:,i] = col
+        return data
+
+    def clear(self):
+        self.entries.clear()
+
+
+class TreeCache(object):
+    ##fitted clusterers keyed by (feature matrix, min_samples). the single linkage tree only depends on those,
+    ##so a new min_cluster_size or distance cutoff re-condenses and re-selects clusters from the stored tree
+    ##instead of refitting, with condensed trees and stabilities also kept per min_cluster_size
+    def __init__(self, max_entries=tree_cache_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def fit(self, key, data, min_cluster_size, min_samples, epsilon, prediction_data=False):
+        ##returns the clusterer and whether it had to be refit. get_clusters edits the stability dict in place, so it gets a copy
+        entry = self.entries.get((key, min_samples))
+        if entry is None or not entry[0]._all_finite:
+            ##the stored tree of data with non-finite rows has been remapped by hdbscan and cannot be re-condensed
+            return self.refit(key, data, min_cluster_size, min_samples, epsilon, prediction_data), True
+        self.entries.move_to_end((key, min_samples))
+        clusterer, condensed = entry
+        if (clusterer.min_cluster_size, clusterer.cluster_selection_epsilon) == (min_cluster_size, epsilon):
+            return clusterer, False
+        if min_cluster_size not in condensed:
+            tree = condense_tree(clusterer._single_linkage_tree, min_cluster_size)
+            condensed[min_cluster_size] = (tree, compute_stability(tree))
+        tree, stability = condensed[min_cluster_size]
+        labels, probabilities, stabilities = get_clusters(tree, dict(stability), cluster_selection_method=clusterer.cluster_selection_method, allow_single_cluster=clusterer.allow_single_cluster, match_reference_implementation=clusterer.match_reference_implementation, cluster_selection_epsilon=epsilon)[:3]
+        clusterer.min_cluster_size = min_cluster_size
+        clusterer.cluster_selection_epsilon = epsilon
+        clusterer._condensed_tree = tree
+        clusterer.labels_ = labels
+        clusterer.probabilities_ = probabilities
+        clusterer.cluster_persistence_ = stabilities
+        clusterer._prediction_data = None
+        clusterer._outlier_scores = None
+        clusterer._relative_validity = None
+        if prediction_data:
+            clusterer.generate_prediction_data()
+        return clusterer, False
+
+    def refit(self, key, data, min_cluster_size, min_samples, epsilon, prediction_data=False):
+        clusterer = hdbscan.HDBSCAN(min_cluster_size=min_cluster_size, min_samples=min_samples, gen_min_span_tree=True, cluster_selection_epsilon=epsilon, prediction_data=prediction_data)
+        clusterer.fit(data)
+        condensed = OrderedDict()
+        condensed[min_cluster_size] = (clusterer._condensed_tree, compute_stability(clusterer._condensed_tree))
+        self.entries[(key, min_samples)] = (clusterer, condensed)
+        self.entries.move_to_end((key, min_samples))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return clusterer
+
+    def clear(self):
+        self.entries.clear()
+
+
+def stratified_sample(strata, size, seed=0):
+    ##sorted positions of a random sample with every stratum represented in proportion to its size
+    rng = np.random.default_rng(seed)
+    labels, inverse, counts = np.unique(strata, return_inverse=True, return_counts=True)
+    quota = np.floor(counts*float(size)/len(strata)).astype(np.int64)
+    remainder = size - quota.sum()
+    if remainder > 0:
+        quota[np.argsort(counts - quota*len(strata)/float(size))[::-1][:remainder]] += 1
+    order = np.lexsort((rng.random(len(strata)), inverse))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.empty(len(strata), dtype=np.int64)
+    rank[order] = np.arange(len(strata)) - np.repeat(starts, counts)
+    return np.flatnonzero(rank < quota[inverse])
+
+
+def init_predict_worker(clusterer):
+    global predict_clusterer
+    predict_clusterer = clusterer
+
+
+def predict_chunk(points):
+    return hdbscan.approximate_predict(predict_clusterer, points)
+
+
+def predict_labels(clusterer, data, workers=None, chunk_size=predict_chunk_size):
+    ##labels and membership probabilities of new points, chunked over a process pool that receives the
+    ##clusterer once per worker. rows with non-finite features are noise
+    labels = np.full(len(data), -1, dtype=np.int64)
+    probabilities = np.zeros(len(data))
+    finite = np.flatnonzero(np.all(np.isfinite(data), axis=1))
+    chunks = [finite[i:i+chunk_size] for i in range(0, len(finite), chunk_size)]
+    if len(chunks) < 2:
+        results = [hdbscan.approximate_predict(clusterer, data[chunk]) for chunk in chunks]
+    else:
+        workers = min(workers or os.cpu_count() or 1, len(chunks))
+        ##spawned rather than forked workers, since readevents calls this with its trace prefetch thread running
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_predict_worker, initargs=(clusterer,)) as pool:
+            results = list(pool.map(predict_chunk, [data[chunk] for chunk in chunks]))
+    for chunk, (chunk_labels, chunk_probabilities) in zip(chunks, results):
+        labels[chunk] = chunk_labels
+        probabilities[chunk] = chunk_probabilities
+    return labels, probabilities
+
+
+def subsample_fit(tree_cache, key, data, strata, sample_size, min_cluster_size, min_samples, epsilon, seed=0):
+    ##fits a stratified sample of the events through the tree cache and predicts the rest
+    if sample_size >= len(data):
+        clusterer, refit = tree_cache.fit(key, data, min_cluster_size, min_samples, epsilon)
+        return clusterer.labels_, clusterer.probabilities_, refit
+    sample = stratified_sample(strata, sample_size, seed)
+    clusterer, refit = tree_cache.fit(key + (('sample', sample_size, seed),), np.ascontiguousarray(data[sample]), min_cluster_size, min_samples, epsilon, prediction_data=True)
+    rest = np.ones(len(data), dtype=bool)
+    rest[sample] = False
+    labels = np.empty(len(data), dtype=np.int64)
+    probabilities = np.empty(len(data))
+    labels[sample] = clusterer.labels_
+    probabilities[sample] = clusterer.probabilities_
+    labels[rest], probabilities[rest] = predict_labels(clusterer, data[rest])
+    return labels, probabilities, refit
+
+
+def color_table(palette, levels=probability_levels):
+    ##RGBA for every palette color at every quantized membership probability, desaturated the way
+    ##seaborn.desaturate does it, with one extra row for noise points
+    table = np.empty((len(palette)+1, levels, 4))
+    for i, color in enumerate(palette):
+        h, l, s = colorsys.rgb_to_hls(*color[:3])
+        for j in range(levels):
+            table[i,j,:3] = colorsys.hls_to_rgb(h, l, s*j/(levels-1.0))
+    table[:,:,3] = 1
+    table[-1] = noise_color
+    return table
+
+
+def cluster_colors(labels, probabilities, palette):
+    table = color_table(palette)
+    levels = table.shape[1]
+    rows = np.where(labels >= 0, labels % (len(table)-1), len(table)-1)
+    columns = np.clip(np.rint(np.asarray(probabilities)*(levels-1)), 0, levels-1).astype(np.intp)
+    return table[rows, columns]
@@ -0,0 +1,159 @@
+##                                COPYRIGHT
+##    Copyright (C) 2015 Kyle Briggs (kbrig035<at>uottawa.ca)
+##
+##    This file is part of cusumtools.
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+##Binary subset files that keep the level lists as lists instead of semicolon separated strings:
+##    .parquet and .feather through pyarrow, as list<double> columns, written one record batch at a time
+##    .npz as one .npy entry per column, with <col>.values and <col>.offsets for each list column
+##Each can be opened again by readevents in place of the eventsdb csv.
+
+import os
+import zipfile
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from ragged import RaggedColumn
+from eventstable import subset_frame
+
+export_chunk_rows = 2**18
+subset_extensions = ['.csv','.parquet','.feather','.npz']
+
+
+def column_chunk(db, col, start, stop):
+    if col in db.overlay:
+        return db.overlay[col][start:stop]
+    return db.master[col].values[db.rows[start:stop]]
+
+
+def level_chunk(ragged_col, rows):
+    lengths = ragged_col.offsets[rows+1] - ragged_col.offsets[rows]
+    offsets = np.zeros(len(rows)+1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return np.asarray(ragged_col.values[ragged_col.level_index(rows)], dtype=np.float64), offsets
+
+
+def list_columns_of(db, ragged):
+    return [col for col in ragged if col not in db.columns]
+
+
+def write_arrow(path, db, ragged, chunk_rows=export_chunk_rows):
+    import pyarrow as pa
+    extension = os.path.splitext(path)[1].lower()
+    columns = db.columns
+    lists = list_columns_of(db, ragged)
+    writer = None
+    schema = None
+    try:
+        for start in range(0, max(len(db),1), chunk_rows):
+            stop = min(start+chunk_rows, len(db))
+            rows = db.rows[start:stop]
+            arrays = [pa.array(column_chunk(db, col, start, stop)) for col in columns]
+            for col in lists:
+                values, offsets = level_chunk(ragged[col], rows)
+                arrays.append(pa.ListArray.from_arrays(pa.array(offsets.astype(np.int32)), pa.array(values)))
+            table = pa.Table.from_arrays(arrays, names=columns+lists)
+            if writer is None:
+                schema = table.schema
+                if extension == '.parquet':
+                    import pyarrow.parquet as pq
+                    writer = pq.ParquetWriter(path, schema)
+                else:
+                    writer = pa.ipc.new_file(path, schema)
+            writer.write_table(table.cast(schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def read_arrow(path):
+    import pyarrow as pa
+    if os.path.splitext(path)[1].lower() == '.parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+    else:
+        with pa.memory_map(path, 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+    ragged = dict()
+    for name in table.column_names:
+        if pa.types.is_list(table.schema.field(name).type):
+            levels = table.column(name).combine_chunks()
+            values = levels.values.to_numpy(zero_copy_only=False)
+            offsets = levels.offsets.to_numpy().astype(np.int64)
+            ragged[name] = RaggedColumn(values[offsets[0]:offsets[-1]], offsets - offsets[0])
+    eventsdb = table.drop(list(ragged.keys())).to_pandas()
+    return eventsdb, ragged
+
+
+def write_npy(zf, name, dtype, length, chunks):
+    ##streams one array into the archive, so only one chunk of it is ever in memory
+    with zf.open(name+'.npy', 'w', force_zip64=True) as f:
+        np.lib.format.write_array_header_2_0(f, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': (length,)})
+        for chunk in chunks:
+            f.write(np.ascontiguousarray(chunk, dtype=dtype).tobytes())
+
+
+def write_npz(path, db, ragged, chunk_rows=export_chunk_rows):
+    starts = range(0, len(db), chunk_rows)
+    with zipfile.ZipFile(path, 'w', allowZip64=True) as zf:
+        for col in db.columns:
+            sample = column_chunk(db, col, 0, 0)
+            if np.asarray(sample).dtype.kind in 'biuf':
+                dtype = np.asarray(sample).dtype
+                write_npy(zf, col, dtype, len(db), (column_chunk(db, col, start, start+chunk_rows) for start in starts))
+            else:
+                ##strings have no fixed width until the whole column is seen
+                values = np.asarray(db.col(col)).astype(str)
+                write_npy(zf, col, values.dtype, len(db), [values])
+        for col in list_columns_of(db, ragged):
+            rows = db.rows
+            lengths = ragged[col].offsets[rows+1] - ragged[col].offsets[rows]
+            offsets = np.zeros(len(rows)+1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            write_npy(zf, col+'.values', np.float64, int(offsets[-1]), (level_chunk(ragged[col], rows[start:start+chunk_rows])[0] for start in starts))
+            write_npy(zf, col+'.offsets', np.int64, len(offsets), [offsets])
+
+
+def read_npz(path):
+    columns = OrderedDict()
+    ragged = dict()
+    with np.load(path, allow_pickle=False) as f:
+        for name in f.files:
+            if name.endswith('.values'):
+                col = name[:-len('.values')]
+                ragged[col] = RaggedColumn(f[name], f[col+'.offsets'])
+            elif not name.endswith('.offsets'):
+                columns[name] = f[name]
+    return pd.DataFrame(columns), ragged
+
+
+def write_subset(path, db, ragged):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ['.parquet','.feather']:
+        write_arrow(path, db, ragged)
+    elif extension == '.npz':
+        write_npz(path, db, ragged)
+    else:
+        subset_frame(db, ragged).to_csv(path, index=False)
+
+
+def read_subset(path):
+    ##same return as eventstable.read_eventsdb, for subsets saved in one of the binary formats
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ['.parquet','.feather']:
+        return read_arrow(path)
+    return read_npz(path)
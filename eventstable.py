@@ -0,0 +1,180 @@
+##                                COPYRIGHT
+##    Copyright (C) 2015 Kyle Briggs (kbrig035<at>uottawa.ca)
+##
+##    This file is part of cusumtools.
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from ragged import list_columns, parse_list_column, concat_ragged, cached_columns, read_ragged_cache, write_ragged_cache, load_ragged_columns
+
+read_chunksize = 200000
+
+##dtypes for the eventsdb columns readevents knows about. times and ids keep full precision, since
+##start_time_s over a long recording and event_delay_s as its difference need more than float32 digits,
+##everything measured on a single event fits float32. unknown columns are left to pandas
+eventsdb_schema = {'id': np.int64,
+                   'type': np.int32,
+                   'start_time_s': np.float64,
+                   'event_delay_s': np.float64,
+                   'n_levels': np.int32,
+                   'intra_crossings': np.int32}
+for col in ['duration_us','threshold','baseline_before_pA','baseline_after_pA','effective_baseline_pA','area_pC',
+            'average_blockage_pA','relative_average_blockage','max_blockage_pA','relative_max_blockage',
+            'max_blockage_duration_us','min_blockage_pA','relative_min_blockage','min_blockage_duration_us',
+            'rc_const1_us','rc_const2_us','residual_pA','max_deviation_pA','first_level_fraction']:
+    eventsdb_schema[col] = np.float32
+
+##extra per-event columns computed from the level lists when a database is opened, each entry maps
+##a column name to a function of the ragged level columns, for example
+##level_features['longest_level_us'] = lambda ragged: ragged['level_duration_us'].strip_baseline().reduce('max')
+level_features = OrderedDict()
+
+
+def read_columns(file_path_string, usecols, dtype, chunksize):
+    ##yields the csv chunk by chunk with the schema applied to each chunk once it is parsed. a column that does
+    ##not fit the schema in some chunk, like an integer column with a blank entry, keeps the type pandas gave
+    ##it there and pd.concat settles on a common type, so a bad row never restarts the read
+    strings = dict((key, val) for key, val in dtype.items() if val is str)
+    for chunk in pd.read_csv(file_path_string, usecols=usecols, dtype=strings, chunksize=chunksize, encoding='utf-8'):
+        for col, col_dtype in dtype.items():
+            if col_dtype is not str and col in chunk.columns:
+                try:
+                    chunk[col] = chunk[col].astype(col_dtype)
+                except (ValueError, TypeError, OverflowError):
+                    pass
+        yield chunk
+
+
+def read_eventsdb(file_path_string, chunksize=read_chunksize):
+    ##reads the events table in chunks with compact dtypes. the semicolon separated list columns never enter
+    ##the table: they come from the ragged cache when it is current, otherwise each chunk of them is parsed as
+    ##it arrives. returns the table in file order and its ragged columns
+    header = pd.read_csv(file_path_string, nrows=0, encoding='utf-8').columns
+    lists = [col for col in list_columns if col in header]
+    meta = cached_columns(file_path_string)
+    if meta is not None and all(col in meta.get('columns', []) for col in lists):
+        parse = []
+    else:
+        parse = lists
+    usecols = [col for col in header if col not in lists or col in parse]
+    dtype = dict((col, eventsdb_schema[col]) for col in usecols if col in eventsdb_schema)
+    dtype.update((col, str) for col in parse)
+
+    frames = []
+    parts = dict((col, []) for col in parse)
+    for chunk in read_columns(file_path_string, usecols, dtype, chunksize):
+        for col in parse:
+            parts[col].append(parse_list_column(chunk.pop(col)))
+        frames.append(chunk)
+    if len(frames) > 0:
+        eventsdb = pd.concat(frames, ignore_index=True)
+    else:
+        eventsdb = pd.DataFrame(columns=[col for col in usecols if col not in parse])
+    del frames
+
+    if parse:
+        ragged = dict((col, concat_ragged(parts[col])) for col in parse)
+        try:
+            write_ragged_cache(file_path_string, ragged)
+        except OSError:
+            pass
+    else:
+        ragged = read_ragged_cache(file_path_string, len(eventsdb))
+        if ragged is None:
+            ##the cache went stale between the header check and now, parse the list columns on their own
+            ragged = dict((col, []) for col in lists)
+            for chunk in read_columns(file_path_string, lists, dict((col, str) for col in lists), chunksize):
+                for col in lists:
+                    ragged[col].append(parse_list_column(chunk[col]))
+            ragged = dict((key, concat_ragged(val)) for key, val in ragged.items())
+    return eventsdb, ragged
+
+
+def memory_usage(eventsdb, ragged):
+    ##bytes held by the events table and its level columns, the latter possibly memory mapped
+    table = int(eventsdb.memory_usage(index=True, deep=True).sum())
+    levels = sum(int(val.values.nbytes + val.offsets.nbytes) for val in ragged.values())
+    return table, levels
+
+
+def subset_frame(db, ragged):
+    ##the subset as it is written to csv, with the level lists joined back into semicolon separated strings
+    frame = db.frame()
+    for col in list_columns:
+        if col in ragged and col not in frame.columns:
+            frame[col] = ragged[col].strings(db.rows)
+    return frame
+
+
+def prepare_eventsdb(eventsdb, file_path_string, ragged=None):
+    ##adds the derived columns readevents works with and returns the events table, sorted by id, together
+    ##with its ragged level columns in the same row order. ragged is what read_eventsdb returned, if the
+    ##table came from there, otherwise the list columns are parsed from the table
+    eventsdb['adj_id'] = np.arange(0,len(eventsdb))
+    if 'event_shape' not in eventsdb.columns:
+        eventsdb['event_shape']=""
+    if 'trimmed_shape' not in eventsdb.columns:
+        eventsdb['trimmed_shape']=""
+    if 'trimmed_n_levels' not in eventsdb.columns:
+        eventsdb['trimmed_n_levels']=""
+    if 'first_level' not in eventsdb.columns:
+        eventsdb['first_level']=""
+        eventsdb['last_level']=""
+    if 'cluster_id' not in eventsdb.columns:
+        eventsdb['cluster_id']=""
+
+    if ragged is None:
+        ragged = load_ragged_columns(file_path_string, eventsdb)
+    csv_ids = eventsdb['id'].values
+    eventsdb = count(eventsdb)
+    ragged = align_ragged(ragged, csv_ids)
+    if 'first_level_fraction' not in eventsdb.columns:
+        first_level_fraction(eventsdb, ragged)
+    folding_distribution(eventsdb)
+    user_level_features(eventsdb, ragged)
+    return eventsdb, ragged
+
+
+def count(eventsdb):
+    if not eventsdb['id'].is_monotonic_increasing:
+        eventsdb = eventsdb.sort_values('id', kind='mergesort').reset_index(drop=True)
+    eventsdb['count'] = np.arange(len(eventsdb))
+    return eventsdb
+
+
+def align_ragged(ragged, csv_ids):
+    order = np.argsort(csv_ids, kind='mergesort')
+    if np.any(order != np.arange(len(order))):
+        ragged = dict((key, val.take(order)) for key, val in ragged.items())
+    return ragged
+
+
+def first_level_fraction(eventsdb, ragged):
+    durations = ragged['level_duration_us'].strip_baseline()
+    first = durations.reduce('first')
+    eventsdb['first_level_fraction'] = first/(durations.reduce('sum')+first)
+
+
+def folding_distribution(eventsdb):
+    x = eventsdb['max_blockage_duration_us']/(eventsdb['duration_us']+eventsdb['max_blockage_duration_us'])
+    eventsdb['folding'] = x
+
+
+def user_level_features(eventsdb, ragged):
+    for key, val in level_features.items():
+        if key not in eventsdb.columns:
+            eventsdb[key] = val(ragged)
@@ -0,0 +1,256 @@
+##                                COPYRIGHT
+##    Copyright (C) 2015 Kyle Briggs (kbrig035<at>uottawa.ca)
+##
+##    This file is part of cusumtools.
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+##Packed container for event traces. Layout of an events.evt file:
+##    header (32 bytes): magic, format version, number of events, byte offset of the index
+##    one block per event: time as float64, then current, cusum (and stepfit) as float32
+##    index: one record per event, sorted by event id, giving the block offset and shape
+
+import os
+import re
+import sys
+import glob
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+magic = b'CUSUMEVT'
+format_version = 1
+container_name = 'events.evt'
+column_names = ['time','current','cusum','stepfit']
+header_dtype = np.dtype([('magic','S8'),('version','<u4'),('reserved','<u4'),('num_events','<u8'),('index_offset','<u8')])
+index_dtype = np.dtype([('id','<i8'),('columns','<i4'),('reserved','<i4'),('samples','<i8'),('offset','<i8')])
+
+
+class EventTraces(object):
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        header = np.frombuffer(self.data, dtype=header_dtype, count=1)[0]
+        if header['magic'] != magic or header['version'] != format_version:
+            raise ValueError('{0} is not an event trace container'.format(path))
+        self.index = np.frombuffer(self.data, dtype=index_dtype, count=int(header['num_events']), offset=int(header['index_offset']))
+        self.ids = self.index['id']
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, event_id):
+        return self.find(event_id) >= 0
+
+    def find(self, event_id):
+        i = np.searchsorted(self.ids, event_id)
+        if i < len(self.ids) and self.ids[i] == event_id:
+            return int(i)
+        return -1
+
+    def arrays(self, event_id):
+        i = self.find(event_id)
+        if i < 0:
+            raise KeyError(event_id)
+        entry = self.index[i]
+        samples = int(entry['samples'])
+        offset = int(entry['offset'])
+        arrays = [np.frombuffer(self.data, dtype='<f8', count=samples, offset=offset)]
+        offset += 8*samples
+        for j in range(int(entry['columns'])-1):
+            arrays.append(np.frombuffer(self.data, dtype='<f4', count=samples, offset=offset))
+            offset += 4*samples
+        return arrays
+
+    def get(self, event_id):
+        arrays = self.arrays(event_id)
+        return pd.DataFrame(OrderedDict(zip(column_names, arrays)))
+
+
+class EventTraceWriter(object):
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path,'wb')
+        self.f.write(np.zeros(1, dtype=header_dtype).tobytes())
+        self.entries = []
+
+    def add(self, event_id, columns):
+        offset = self.f.tell()
+        samples = len(columns[0])
+        self.f.write(np.ascontiguousarray(columns[0], dtype='<f8').tobytes())
+        for col in columns[1:]:
+            self.f.write(np.ascontiguousarray(col, dtype='<f4').tobytes())
+        padding = -self.f.tell() % 8
+        if padding:
+            self.f.write(b'\0'*padding)
+        self.entries.append((event_id, len(columns), 0, samples, offset))
+
+    def close(self):
+        index = np.array(self.entries, dtype=index_dtype)
+        index = index[np.argsort(index['id'], kind='mergesort')]
+        index_offset = self.f.tell()
+        self.f.write(index.tobytes())
+        header = np.zeros(1, dtype=header_dtype)
+        header['magic'] = magic
+        header['version'] = format_version
+        header['num_events'] = len(index)
+        header['index_offset'] = index_offset
+        self.f.seek(0)
+        self.f.write(header.tobytes())
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TraceCache(object):
+    ##LRU cache of loaded traces, bounded in bytes, filled by a background thread that prefetches requested ids
+    def __init__(self, loader, budget_bytes):
+        self.loader = loader
+        self.budget = budget_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.pending = []
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.fetch_time = 0.0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self.worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def fetch(self, event_id):
+        start = time.perf_counter()
+        trace = self.loader(event_id)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.fetches += 1
+            self.fetch_time += elapsed
+        return trace
+
+    def insert(self, event_id, trace, generation):
+        nbytes = int(trace.memory_usage(index=True).sum())
+        with self.lock:
+            if generation != self.generation or event_id in self.entries or nbytes > self.budget:
+                return
+            self.entries[event_id] = (trace, nbytes)
+            self.size += nbytes
+            while self.size > self.budget:
+                old_trace, old_bytes = self.entries.popitem(last=False)[1]
+                self.size -= old_bytes
+
+    def get(self, event_id):
+        with self.lock:
+            entry = self.entries.get(event_id)
+            if entry is not None:
+                self.entries.move_to_end(event_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self.generation
+        trace = self.fetch(event_id)
+        if trace is not None:
+            self.insert(event_id, trace, generation)
+        return trace
+
+    def prefetch(self, event_ids):
+        with self.lock:
+            self.pending = [i for i in event_ids if i not in self.entries]
+        self.wake.set()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.pending = []
+            self.generation += 1
+
+    def worker(self):
+        while True:
+            self.wake.wait()
+            with self.lock:
+                if len(self.pending) == 0:
+                    self.wake.clear()
+                    continue
+                event_id = self.pending.pop(0)
+                generation = self.generation
+                if event_id in self.entries:
+                    continue
+            try:
+                trace = self.fetch(event_id)
+            except Exception:
+                trace = None
+            if trace is not None:
+                self.insert(event_id, trace, generation)
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            hit_rate = 100.0*self.hits/requests if requests > 0 else 0.0
+            latency = 1000.0*self.fetch_time/self.fetches if self.fetches > 0 else 0.0
+            return 'Cache: {0:.0f}% hits, {1:.1f} ms/fetch, {2} events ({3:.0f} MB)'.format(hit_rate, latency, len(self.entries), self.size/2.0**20)
+
+
+def open_event_traces(path):
+    try:
+        return EventTraces(path)
+    except (OSError, ValueError):
+        return None
+
+
+def read_event_csv(path):
+    ##event files from cusum carry a header row, those from mosaicConverter do not
+    trace = pd.read_csv(path, header=None, encoding='utf-8')
+    trace = trace.apply(pd.to_numeric, errors='coerce')
+    if trace.iloc[0].isnull().any():
+        trace = trace.iloc[1:]
+    return [trace[col].values for col in trace.columns]
+
+
+def convert_events_folder(events_folder, path=None):
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.normpath(events_folder)), container_name)
+    files = glob.glob(os.path.join(events_folder, 'event_*.csv'))
+    ids = [int(re.findall(r'event_(\d+)\.csv$', f)[0]) for f in files]
+    with EventTraceWriter(path) as writer:
+        for n, (event_id, f) in enumerate(sorted(zip(ids, files))):
+            writer.add(event_id, read_event_csv(f))
+            if (n+1) % 1000 == 0:
+                print('{0} of {1} events packed'.format(n+1, len(files)))
+    print('Packed {0} events into {1}'.format(len(files), path))
+    return path
+
+
+def main():
+    if len(sys.argv) > 1:
+        events_folder = sys.argv[1]
+    else:
+        import tkinter as tk
+        import tkinter.filedialog
+        root=tk.Tk()
+        root.withdraw()
+        events_folder = tkinter.filedialog.askdirectory(initialdir='C:/Users/kbrig035/Analysis/CUSUM/output/')
+        root.destroy()
+    convert_events_folder(events_folder, sys.argv[2] if len(sys.argv) > 2 else None)
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,229 @@
+##                                COPYRIGHT
+##    Copyright (C) 2015 Kyle Briggs (kbrig035<at>uottawa.ca)
+##
+##    This file is part of cusumtools.
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import zlib
+from collections import OrderedDict
+import numpy as np
+from subsets import Subset
+
+history_budget = 2**26
+compression_level = 1
+
+
+##undo entries never hold table copies. a subset change is stored as what it takes to rebuild the state on
+##either side from the other: a compressed keep mask when one side is a subset of the other (filters, deletions,
+##reset), and only those columns whose values differ between the two sides
+
+
+class SubsetState(object):
+    def __init__(self, db, filters, capture_rate, good):
+        self.db = db
+        self.filters = filters
+        self.capture_rate = capture_rate
+        self.good = good
+
+
+def pack(values):
+    values = np.ascontiguousarray(values)
+    if values.dtype.hasobject:
+        return (values.dtype, len(values), values.copy())
+    return (values.dtype, len(values), zlib.compress(values.tobytes(), compression_level))
+
+
+def unpack(packed):
+    dtype, n, data = packed
+    if dtype.hasobject:
+        return data.copy()
+    return np.frombuffer(bytearray(zlib.decompress(data)), dtype=dtype, count=n)
+
+
+def packed_size(packed):
+    data = packed[2]
+    return data.nbytes if isinstance(data, np.ndarray) else len(data)
+
+
+def pack_mask(mask):
+    return (len(mask), pack(np.packbits(mask)))
+
+
+def unpack_mask(packed):
+    n, bits = packed
+    return np.unpackbits(unpack(bits), count=n).astype(bool)
+
+
+def encode(src, dst, num_rows):
+    ##what rebuilds dst from src
+    src_db = src.db
+    dst_db = dst.db
+    src_rows = src_db.rows
+    dst_rows = dst_db.rows
+    pos = np.searchsorted(src_rows, dst_rows)
+    inside = pos < len(src_rows)
+    inside[inside] = src_rows[pos[inside]] == dst_rows[inside]
+    diff = dict()
+    if np.all(inside):
+        kept = np.zeros(len(src_rows), dtype=bool)
+        kept[pos] = True
+        diff['kept'] = pack_mask(kept)
+    else:
+        members = np.zeros(num_rows, dtype=bool)
+        members[dst_rows] = True
+        diff['members'] = pack_mask(members)
+    columns = OrderedDict()
+    src_overlay = src_db.overlay
+    for col, val in dst_db.overlay.items():
+        if col in src_overlay and src_db.col_versions.get(col) == dst_db.col_versions.get(col):
+            ##same values wherever both sides hold the row
+            columns[col] = ('shared', pack(val[~inside]) if not np.all(inside) else None)
+        else:
+            columns[col] = ('full', pack(val))
+    diff['columns'] = columns
+    diff['versions'] = (dst_db.version, dst_db.rows_version, dict(dst_db.col_versions))
+    common = 0
+    while common < min(len(src.filters), len(dst.filters)) and src.filters[common] == dst.filters[common]:
+        common += 1
+    diff['filters'] = (common, list(dst.filters[common:]))
+    diff['capture_rate'] = dst.capture_rate
+    diff['good'] = dst.good
+    return diff
+
+
+def decode(src, diff):
+    src_db = src.db
+    src_rows = src_db.rows
+    if 'kept' in diff:
+        kept = unpack_mask(diff['kept'])
+        rows = src_rows[kept]
+        src_pos = np.flatnonzero(kept)
+        inside = np.ones(len(rows), dtype=bool)
+    else:
+        rows = np.flatnonzero(unpack_mask(diff['members']))
+        pos = np.searchsorted(src_rows, rows)
+        inside = pos < len(src_rows)
+        inside[inside] = src_rows[pos[inside]] == rows[inside]
+        src_pos = pos[inside]
+    db = Subset(src_db.master, rows)
+    src_overlay = src_db.overlay
+    for col, (kind, data) in diff['columns'].items():
+        if kind == 'full':
+            val = unpack(data)
+        else:
+            val = np.empty(len(rows), dtype=src_overlay[col].dtype)
+            val[inside] = src_overlay[col][src_pos]
+            if data is not None:
+                val[~inside] = unpack(data)
+        db.set_col(col, val)
+    db.version, db.rows_version, col_versions = diff['versions']
+    db.col_versions = dict(col_versions)
+    common, tail = diff['filters']
+    return SubsetState(db, list(src.filters[:common]) + tail, diff['capture_rate'], diff['good'])
+
+
+def diff_size(diff):
+    size = 0
+    for key in ['kept','members']:
+        if key in diff:
+            size += packed_size(diff[key][1])
+    for kind, data in diff['columns'].values():
+        if data is not None:
+            size += packed_size(data)
+    return size + sum(len(f) for f in diff['filters'][1])
+
+
+class SubsetChange(object):
+    ##one operation on one or more subsets, as (name, backward, forward) diffs
+    def __init__(self, changes, num_rows):
+        self.changes = [(name, encode(after, before, num_rows), encode(before, after, num_rows)) for name, before, after in changes]
+        self.nbytes = sum(diff_size(backward) + diff_size(forward) for name, backward, forward in self.changes)
+
+    def apply(self, app, forward):
+        for name, backward, diff in self.changes:
+            app.set_subset_state(name, decode(app.subset_state(name), diff if forward else backward))
+
+    def undo(self, app):
+        self.apply(app, False)
+
+    def redo(self, app):
+        self.apply(app, True)
+
+
+class Deletion(object):
+    ##a single event deleted while browsing. the subset keeps deleting by tombstone, and undo puts the row back
+    def __init__(self, name, event_id, row, values, was_deleted):
+        self.name = name
+        self.event_id = event_id
+        self.row = row
+        self.values = values
+        self.was_deleted = was_deleted
+        self.nbytes = 64*(len(values)+1)
+
+    def undo(self, app):
+        app.eventsdb_subset[self.name].insert(self.row, self.values)
+        filters = app.filter_list[self.name]
+        filterstring = 'id != {0}'.format(self.event_id)
+        if filterstring in filters:
+            del filters[len(filters) - 1 - filters[::-1].index(filterstring)]
+        app.manual_delete[self.row] = self.was_deleted
+
+    def redo(self, app):
+        if app.eventsdb_subset[self.name].remove_id(self.event_id):
+            app.filter_list[self.name].append('id != {0}'.format(self.event_id))
+        app.manual_delete[self.row] = True
+
+
+class History(object):
+    ##undo and redo stacks bounded by the bytes their entries hold, dropping the oldest undo steps first
+    def __init__(self, budget_bytes=history_budget):
+        self.budget = budget_bytes
+        self.undo_stack = []
+        self.redo_stack = []
+        self.size = 0
+
+    def push(self, entry):
+        self.undo_stack.append(entry)
+        self.size += entry.nbytes
+        for old in self.redo_stack:
+            self.size -= old.nbytes
+        self.redo_stack = []
+        while self.size > self.budget and len(self.undo_stack) > 1:
+            self.size -= self.undo_stack.pop(0).nbytes
+
+    def undo(self, app):
+        if len(self.undo_stack) == 0:
+            return False
+        entry = self.undo_stack.pop()
+        entry.undo(app)
+        self.redo_stack.append(entry)
+        return True
+
+    def redo(self, app):
+        if len(self.redo_stack) == 0:
+            return False
+        entry = self.redo_stack.pop()
+        entry.redo(app)
+        self.undo_stack.append(entry)
+        return True
+
+    def clear(self):
+        self.undo_stack = []
+        self.redo_stack = []
+        self.size = 0
+
+    def stats(self):
+        return '{0} undo, {1} redo steps ({2:.1f} MB)'.format(len(self.undo_stack), len(self.redo_stack), self.size/2.0**20)
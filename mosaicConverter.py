@@ -11,11 +11,12 @@ import pandas as pd
 import pandasql as sqldf
 import tkinter.filedialog
 from progress.bar import ChargingBar, Bar
+from eventtraces import EventTraceWriter, container_name
 db=sql.sqlite3MDIO()
 
 pd.options.mode.chained_assignment = None
 
-def do_Stuff(file_path_string,events_directory_path,directory_path,file_name):
+def do_Stuff(file_path_string,directory_path,file_name):
     db.openDB(glob.glob(file_path_string)[-1])
     q = "SELECT * from metadata WHERE ProcessingStatus='normal'"
     column_list = ['recIDX',
@@ -65,6 +66,7 @@ def do_Stuff(file_path_string,events_directory_path,directory_path,file_name):
     eventsdb = pd.DataFrame(db.queryDB(q), columns=column_list, dtype=object)
     eventsdb_converted = pd.DataFrame(columns=column_list2, dtype=object)
 
+    traces = EventTraceWriter(directory_path + container_name)
     bar = ChargingBar('Processing Events', max=len(eventsdb))
     for index in range(len(eventsdb)):
         eventid = int(eventsdb['recIDX'][index])
@@ -179,16 +181,13 @@ def do_Stuff(file_path_string,events_directory_path,directory_path,file_name):
                                  'blockages_pA' : blockages_pA,
                                  'stdev_pA' : stdev_pA}
         
-        eventtrace = pd.DataFrame(data=np.array([timescale, timeseries, eventfit]).T)
-        eventfile = 'event_%08d.csv' %(eventid)
-        event_file_name = events_directory_path + eventfile
-        with open(event_file_name, 'wb'):
-            eventtrace.to_csv(event_file_name, index=False, header=False)
+        traces.add(eventid, [timescale, timeseries, eventfit])
 
         eventsdb_converted = eventsdb_converted.append(column_dict_converted, ignore_index=True)
         next(bar)
 
     bar.finish()
+    traces.close()
     filename = directory_path + file_name[:-7] + '_converted.csv'
     with open(filename, 'wb'):
         eventsdb_converted.to_csv(filename, index=False)
@@ -201,8 +200,7 @@ def main():
     file_name = os.path.basename(file_path_string)
     directory_path = os.path.dirname(os.path.abspath(file_path_string))
     directory_path = directory_path + '\\' + file_name[:-7] + '\\'
-    events_directory_path = directory_path + 'events\\'
-    do_Stuff(file_path_string,events_directory_path,directory_path,file_name)
+    do_Stuff(file_path_string,directory_path,file_name)
     
 
 if __name__=="__main__":
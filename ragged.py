@@ -0,0 +1,358 @@
+##                                COPYRIGHT
+##    Copyright (C) 2015 Kyle Briggs (kbrig035<at>uottawa.ca)
+##
+##    This file is part of cusumtools.
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+list_columns = ['blockages_pA','level_current_pA','level_duration_us','stdev_pA']
+parse_chunksize = 200000
+hash_blocksize = 2**22
+
+
+class RaggedColumn(object):
+    ##one flat array of level values plus offsets[i]:offsets[i+1] marking the levels of event i
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = offsets
+        self._interior = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def event(self, row):
+        return self.values[self.offsets[row]:self.offsets[row+1]]
+
+    def interior(self):
+        ##True for every level except the baseline levels at either end of each event
+        if self._interior is None:
+            interior = np.ones(len(self.values), dtype=bool)
+            nonempty = self.offsets[1:] > self.offsets[:-1]
+            interior[self.offsets[:-1][nonempty]] = False
+            interior[self.offsets[1:][nonempty] - 1] = False
+            self._interior = interior
+        return self._interior
+
+    def level_index(self, rows=None, include_baseline=True):
+        if rows is None:
+            index = np.arange(len(self.values), dtype=np.int64)
+        else:
+            rows = np.asarray(rows, dtype=np.int64)
+            starts = self.offsets[rows]
+            lengths = self.offsets[rows+1] - starts
+            index = np.arange(lengths.sum(), dtype=np.int64) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        if not include_baseline:
+            index = index[self.interior()[index]]
+        return index
+
+    def select(self, rows=None, include_baseline=True):
+        return self.values[self.level_index(rows, include_baseline)]
+
+    def reduce(self, name):
+        return segment_reducers[name](np.asarray(self.values), np.asarray(self.offsets))
+
+    def take(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = self.offsets[rows+1] - self.offsets[rows]
+        offsets = np.zeros(len(rows)+1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return RaggedColumn(np.asarray(self.values[self.level_index(rows)]), offsets)
+
+    def strings(self, rows=None):
+        ##semicolon separated levels of each row, as they appear in the eventsdb csv
+        if rows is None:
+            rows = np.arange(len(self), dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int64)
+        levels = np.asarray(self.values[self.level_index(rows)]).astype(str)
+        bounds = np.cumsum(self.offsets[rows+1] - self.offsets[rows])[:-1]
+        return [';'.join(event) for event in np.split(levels, bounds)]
+
+    def strip_baseline(self):
+        lengths = np.maximum(self.lengths() - 2, 0)
+        offsets = np.zeros(len(self)+1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return RaggedColumn(np.asarray(self.values[self.interior()]), offsets)
+
+
+def parse_list_column(strings):
+    strings = strings.fillna('').astype(str).values
+    lengths = np.zeros(len(strings), dtype=np.int64)
+    values = []
+    for start in range(0, len(strings), parse_chunksize):
+        chunk = strings[start:start+parse_chunksize]
+        chunk = chunk[chunk != '']
+        lengths[start:start+parse_chunksize][strings[start:start+parse_chunksize] != ''] = [s.count(';') + 1 for s in chunk]
+        if len(chunk) > 0:
+            values.append(np.array(';'.join(chunk).split(';'), dtype=np.float64))
+    offsets = np.zeros(len(strings)+1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.concatenate(values) if len(values) > 0 else np.zeros(0, dtype=np.float64)
+    return RaggedColumn(values, offsets)
+
+
+def concat_ragged(parts):
+    if len(parts) == 0:
+        return RaggedColumn(np.zeros(0, dtype=np.float64), np.zeros(1, dtype=np.int64))
+    values = np.concatenate([part.values for part in parts])
+    lengths = np.concatenate([part.lengths() for part in parts])
+    offsets = np.zeros(len(lengths)+1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return RaggedColumn(values, offsets)
+
+
+def cache_folder(file_path):
+    return os.path.splitext(os.path.abspath(file_path))[0] + '.ragged'
+
+
+def cached_columns(file_path):
+    ##list columns held by a ragged cache that is still current for this csv, or None
+    try:
+        with open(os.path.join(cache_folder(file_path),'meta.json'),'r') as f:
+            meta = json.load(f)
+        stat = os.stat(file_path)
+    except (OSError, ValueError):
+        return None
+    if meta.get('mtime_ns') != stat.st_mtime_ns or meta.get('size') != stat.st_size:
+        return None
+    return meta
+
+
+def source_hash(file_path):
+    ##sha256 of the csv contents, kept in the cache meta so it is computed once per version of the file
+    meta = cached_columns(file_path)
+    if meta is not None and 'sha256' in meta:
+        return meta['sha256']
+    digest = hashlib.sha256()
+    with open(file_path,'rb') as f:
+        for block in iter(lambda: f.read(hash_blocksize), b''):
+            digest.update(block)
+    sha256 = digest.hexdigest()
+    if meta is not None:
+        meta['sha256'] = sha256
+        try:
+            with open(os.path.join(cache_folder(file_path),'meta.json'),'w') as f:
+                json.dump(meta, f)
+        except OSError:
+            pass
+    return sha256
+
+
+def read_ragged_cache(file_path, num_events):
+    folder = cache_folder(file_path)
+    meta = cached_columns(file_path)
+    if meta is None or meta.get('num_events') != num_events:
+        return None
+    ragged = dict()
+    try:
+        for col in meta['columns']:
+            values = np.load(os.path.join(folder, col+'.values.npy'), mmap_mode='r')
+            offsets = np.load(os.path.join(folder, col+'.offsets.npy'), mmap_mode='r')
+            ragged[col] = RaggedColumn(values, offsets)
+    except (OSError, ValueError):
+        return None
+    return ragged
+
+
+def write_ragged_cache(file_path, ragged):
+    folder = cache_folder(file_path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    meta_path = os.path.join(folder,'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for col, val in ragged.items():
+        np.save(os.path.join(folder, col+'.values.npy'), np.asarray(val.values, dtype=np.float64))
+        np.save(os.path.join(folder, col+'.offsets.npy'), np.asarray(val.offsets, dtype=np.int64))
+    stat = os.stat(file_path)
+    meta = {'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'num_events': len(next(iter(ragged.values()))) if len(ragged) > 0 else 0,
+            'columns': list(ragged.keys())}
+    ##meta is written last so that an interrupted build is never mistaken for a valid cache
+    with open(meta_path,'w') as f:
+        json.dump(meta, f)
+
+
+def load_ragged_columns(file_path, eventsdb):
+    ragged = read_ragged_cache(file_path, len(eventsdb))
+    if ragged is None or any(col not in ragged for col in list_columns if col in eventsdb.columns):
+        ragged = dict((col, parse_list_column(eventsdb[col])) for col in list_columns if col in eventsdb.columns)
+        try:
+            write_ragged_cache(file_path, ragged)
+        except OSError:
+            pass
+    return ragged
+
+
+def _segment_reduce(ufunc, values, offsets, empty):
+    lengths = np.diff(offsets)
+    nonempty = lengths > 0
+    out = np.full(len(lengths), empty, dtype=np.result_type(values, np.asarray(empty)) if len(values) > 0 else type(empty))
+    if np.any(nonempty):
+        out[nonempty] = ufunc.reduceat(values, offsets[:-1][nonempty])
+    return out
+
+
+def segment_length(values, offsets):
+    return np.diff(offsets)
+
+
+def segment_first(values, offsets, empty=np.nan):
+    lengths = np.diff(offsets)
+    out = np.full(len(lengths), empty, dtype=np.result_type(values, np.asarray(empty)))
+    out[lengths > 0] = values[offsets[:-1][lengths > 0]]
+    return out
+
+
+def segment_last(values, offsets, empty=np.nan):
+    lengths = np.diff(offsets)
+    out = np.full(len(lengths), empty, dtype=np.result_type(values, np.asarray(empty)))
+    out[lengths > 0] = values[offsets[1:][lengths > 0] - 1]
+    return out
+
+
+def segment_sum(values, offsets):
+    return _segment_reduce(np.add, values, offsets, 0)
+
+
+def segment_max(values, offsets, empty=np.nan):
+    return _segment_reduce(np.maximum, values, offsets, empty)
+
+
+def segment_min(values, offsets, empty=np.nan):
+    return _segment_reduce(np.minimum, values, offsets, empty)
+
+
+def segment_mean(values, offsets):
+    lengths = np.diff(offsets)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return segment_sum(values, offsets)/lengths
+
+
+def _segment_arg(values, offsets, extreme):
+    ##position of the first extreme value within each event, -1 for events without levels
+    lengths = np.diff(offsets)
+    position = np.arange(len(values), dtype=np.int64)
+    is_extreme = values == np.repeat(extreme, lengths)
+    first = _segment_reduce(np.minimum, np.where(is_extreme, position, len(values)), offsets, -1)
+    out = first - offsets[:-1]
+    out[(lengths == 0) | (first == len(values))] = -1
+    return out
+
+
+def segment_argmax(values, offsets):
+    return _segment_arg(values, offsets, segment_max(values, offsets))
+
+
+def segment_argmin(values, offsets):
+    return _segment_arg(values, offsets, segment_min(values, offsets))
+
+
+def segment_any(values, offsets):
+    return segment_sum(np.asarray(values, dtype=bool).astype(np.int64), offsets) > 0
+
+
+def segment_all(values, offsets):
+    return segment_sum((~np.asarray(values, dtype=bool)).astype(np.int64), offsets) == 0
+
+
+def segment_count(values, offsets):
+    return segment_sum(np.asarray(values, dtype=bool).astype(np.int64), offsets)
+
+
+##reductions available to RaggedColumn.reduce, add entries here for custom per-event features
+segment_reducers = OrderedDict([('first', segment_first),
+                                ('last', segment_last),
+                                ('sum', segment_sum),
+                                ('mean', segment_mean),
+                                ('max', segment_max),
+                                ('min', segment_min),
+                                ('argmax', segment_argmax),
+                                ('argmin', segment_argmin),
+                                ('length', segment_length),
+                                ('any', segment_any),
+                                ('all', segment_all),
+                                ('count', segment_count)])
+
+
+def encode_shapes(states, offsets, base):
+    ##positional integer code per event, so that with base 10 the states 1,2,1 read as 121.
+    ##shapes too long to fit in an int64 get a hashed code below -1 instead
+    lengths = np.diff(offsets)
+    from_end = np.repeat(offsets[1:], lengths) - 1 - np.arange(len(states), dtype=np.int64)
+    max_digits = int(63*np.log(2)/np.log(base))
+    exact = lengths <= max_digits
+    exact_level = np.repeat(exact, lengths)
+    powers = np.cumprod(np.concatenate([[1], np.full(max_digits-1, base)])).astype(np.int64)
+    weights = powers[np.minimum(from_end, max_digits-1)]
+    weights[~exact_level] = 0
+    codes = _segment_reduce(np.add, states.astype(np.int64)*weights, offsets, np.int64(0))
+    if not np.all(exact):
+        multipliers = np.full(max(lengths.max(),1), np.uint64(1099511628211), dtype=np.uint64)
+        multipliers[0] = 1
+        hash_weights = np.cumprod(multipliers, dtype=np.uint64)[from_end]
+        hashes = _segment_reduce(np.add, states.astype(np.uint64)*hash_weights, offsets, np.uint64(0))
+        codes[~exact] = -2 - (hashes[~exact] & np.uint64(0x3fffffffffffffff)).astype(np.int64)
+    return codes
+
+
+def classify_shapes(levels, state_array):
+    ##levels holds the blockage levels of each event without baseline; state_array holds [low, high] pairs in click order
+    bounds = np.sort(np.reshape(np.asarray(state_array, dtype=np.float64), (-1,2)), axis=1)
+    num_states = len(bounds)
+    order = np.argsort(bounds[:,0], kind='mergesort')
+    edges = bounds[order].ravel()
+    if np.any(np.diff(edges) < 0):
+        raise ValueError('State boundaries overlap')
+    values = np.asarray(levels.values, dtype=np.float64)
+    offsets = np.asarray(levels.offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    numevents = len(lengths)
+
+    position = np.searchsorted(edges, values, side='right')
+    inside = (position % 2 == 1) & (values != edges[np.maximum(position-1,0)])
+    states = np.where(inside, order[(position-1)//2] + 1, 0)
+    event = np.repeat(np.arange(numevents), lengths)
+    valid = (np.bincount(event[~inside], minlength=numevents) == 0) & (lengths > 0)
+
+    starts = offsets[:-1][lengths > 0]
+    change = np.ones(len(states), dtype=bool)
+    change[1:] = states[1:] != states[:-1]
+    change[starts] = True
+    trimmed_n_levels = np.bincount(event[change], minlength=numevents)
+    trimmed_offsets = np.zeros(numevents+1, dtype=np.int64)
+    np.cumsum(trimmed_n_levels, out=trimmed_offsets[1:])
+
+    base = 10 if num_states < 10 else num_states + 1
+    event_shape = np.where(valid, encode_shapes(states, offsets, base), -1)
+    trimmed_shape = np.where(valid, encode_shapes(states[change], trimmed_offsets, base), -1)
+    first_level = np.full(numevents, -1, dtype=np.int64)
+    last_level = np.full(numevents, -1, dtype=np.int64)
+    first_level[valid] = states[offsets[:-1][valid]]
+    last_level[valid] = states[offsets[1:][valid] - 1]
+    trimmed_n_levels[~valid] = 0
+    return OrderedDict([('event_shape', event_shape),
+                        ('trimmed_shape', trimmed_shape),
+                        ('trimmed_n_levels', trimmed_n_levels),
+                        ('first_level', first_level),
+                        ('last_level', last_level)])
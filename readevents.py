@@ -16,8 +16,11 @@
 ##    You should have received a copy of the GNU General Public License
 ##    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
+import_start = time.perf_counter()
+import sys
+import importlib
 import pandas as pd
-from pandasql import sqldf
 import matplotlib
 matplotlib.use('TkAgg')
 import numpy as np
@@ -26,25 +29,50 @@ import tkinter.filedialog
 import tkinter as tk
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
-from scipy.optimize import curve_fit
 import itertools
 from collections import OrderedDict
-from scipy.stats import t, median_absolute_deviation
-import pylab as pl
 import re
 from tkinter import ttk
-from mpl_toolkits.mplot3d import Axes3D
-import seaborn as sns
-import hdbscan
+from ragged import classify_shapes, source_hash
+from eventstable import prepare_eventsdb, read_eventsdb, memory_usage
+from subsets import Subset, find_sorted
+from session import save_session, load_session
+from history import History, SubsetState, SubsetChange, Deletion
+from columnar import write_subset, read_subset, subset_extensions
+from sqlsession import SqlSession, sql_prefix
+from eventtraces import open_event_traces, container_name, TraceCache
+from binning import density_grid, composite, shared_edges, histogram, histogram2d, HistogramCache
+from capturerate import interevent_delays, capture_rates, survival, windowed_capture_rate
 ##matplotlib inline
-sns.set_context('poster')
-sns.set_style('white')
-sns.set_color_codes()
+##seaborn, scipy and hdbscan (through clustering) take seconds to import, so they are imported on first use
+##with timed_import, and import_times keeps what each one cost for the report under Ctrl+I
+import_times = OrderedDict()
+import_times['readevents'] = time.perf_counter() - import_start
+
+
+def timed_import(name):
+    module = sys.modules.get(name)
+    if module is None:
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        import_times[name] = time.perf_counter() - start
+    return module
+
+
+def import_report():
+    return 'Imports: ' + ', '.join('{0} {1:.2f} s'.format(key, val) for key, val in import_times.items())
+
+
+def set_plot_style():
+    sns = timed_import('seaborn')
+    sns.set_context('poster')
+    sns.set_style('white')
+    sns.set_color_codes()
 plot_kwds = {'alpha' : 0.5, 's' : 80, 'linewidths':0}
+cluster_strata = 20
 matplotlib.rcParams['figure.constrained_layout.use'] = True
 pd.options.mode.chained_assignment = None  # default='warn'
 
-
 class FlashableLabel(tk.Label):
     def flash(self,count):
         bg = self.cget('background')
@@ -56,17 +84,17 @@ class FlashableLabel(tk.Label):
 
 
 class App(tk.Frame):
-    def __init__(self,parent,eventsdb,ratedb,summary,events_folder,file_path_string):
+    def __init__(self,parent,eventsdb,ratedb,summary,events_folder,file_path_string,ragged=None):
         tk.Frame.__init__(self, parent)
         self.ntbk = ttk.Notebook(parent)
         
         self.file_path_string = file_path_string
         self.events_folder = events_folder
-        self.eventsdb = eventsdb
-        [a,b] = self.eventsdb.shape
-        self.eventsdb['adj_id'] = np.arange(0,a)
+        self.event_traces = open_event_traces(os.path.join(os.path.dirname(os.path.abspath(file_path_string)), container_name))
+        self.eventsdb, self.ragged = prepare_eventsdb(eventsdb, file_path_string, ragged)
         self.clicks_remaining = 0
         self.ratedb = ratedb
+        self.sql_session = SqlSession(self.eventsdb, ratedb)
 
         self.intra_threshold = 0
         self.intra_hysteresis = 0
@@ -80,37 +108,28 @@ class App(tk.Frame):
         summary.close()
         
         max_subsets = 11
-        self.eventsdb_subset = dict(('Subset {0}'.format(i), self.eventsdb) for i in range(max_subsets))
-        self.capture_rate_subset = dict.fromkeys(list(self.eventsdb_subset.keys()))
         self.filter_list = dict(('Subset {0}'.format(i), []) for i in range(max_subsets))
         self.plot_list = dict(('Subset {0}'.format(i), 0) for i in range(max_subsets))
         self.plot_list['Subset 0'] = 1
         self.init_plot_list = self.plot_list.copy()
         self.good_event_subset = []
 
-        if 'event_shape' not in eventsdb.columns:
-            eventsdb['event_shape']=""
-        if 'trimmed_shape' not in eventsdb.columns:
-            eventsdb['trimmed_shape']=""
-        if 'trimmed_n_levels' not in eventsdb.columns:    
-            eventsdb['trimmed_n_levels']=""
-        if 'first_level' not in eventsdb.columns:
-            eventsdb['first_level']=""
-            eventsdb['last_level']=""
-        if 'first_level_fraction' not in eventsdb.columns:
-            eventsdb['first_level_fraction']=""
-            self.first_level_fraction()
-        if 'cluster_id' not in eventsdb.columns:
-            eventsdb['cluster_id']=""
-            
-        self.folding_distribution()
-        self.count()
+        self.eventsdb_subset = dict(('Subset {0}'.format(i), Subset(self.eventsdb)) for i in range(max_subsets))
+        self.capture_rate_subset = dict.fromkeys(list(self.eventsdb_subset.keys()))
 
         self.export_type = None
 
-        self.manual_delete = []
+        self.manual_delete = np.zeros(len(self.eventsdb), dtype=bool)
+        self.max_id = self.eventsdb['id'].values[-1]
+        self.pending_plot = None
+        self.pending_density = None
+        self.density_axes = None
+        self.feature_cache = None
+        self.histogram_cache = HistogramCache()
+        self.tree_cache = None
+        self.history = History()
         
-        column_list = list(eventsdb)
+        column_list = list(self.eventsdb) + [col for col in self.ragged if col not in self.eventsdb.columns]
         self.column_list = column_list
         self.x_col_options = tk.StringVar()
         self.x_col_options.set('Level Duration (us)')
@@ -179,6 +198,21 @@ class App(tk.Frame):
         self.capture_rate_button = tk.Button(self.stats_frame,text='Fit Capture Rate',command=self.capture_rate)
         self.use_histogram = tk.IntVar()
         self.use_histogram_check = tk.Checkbutton(self.stats_frame, text='Use Histogram', variable = self.use_histogram)
+        self.use_mle = tk.IntVar()
+        self.use_mle_check = tk.Checkbutton(self.stats_frame, text='MLE Fit', variable = self.use_mle)
+        self.censor_gaps = tk.IntVar()
+        self.censor_gaps_check = tk.Checkbutton(self.stats_frame, text='Censor Gaps', variable = self.censor_gaps)
+        self.rate_window_label = tk.Label(self.stats_frame,text='Window (s):')
+        self.rate_window_entry = tk.Entry(self.stats_frame)
+        self.rate_window_entry.insert(0,600)
+        self.rate_step_label = tk.Label(self.stats_frame,text='Step (s):')
+        self.rate_step_entry = tk.Entry(self.stats_frame)
+        self.rate_step_entry.insert(0,60)
+        self.rate_time_button = tk.Button(self.stats_frame,text='Capture Rate vs Time',command=self.capture_rate_time)
+        self.density_plot = tk.IntVar()
+        self.density_plot_check = tk.Checkbutton(self.stats_frame, text='Density XY Plot', variable = self.density_plot)
+        self.sparse_export = tk.IntVar()
+        self.sparse_export_check = tk.Checkbutton(self.stats_frame, text='Sparse 2D Export', variable = self.sparse_export)
 
 
         self.stats_frame.grid(row=0,column=0,columnspan=6,sticky=tk.N+tk.S)
@@ -204,6 +238,15 @@ class App(tk.Frame):
         self.define_event_shapes_button.grid(row=5,column=3,sticky=tk.E+tk.W)
         self.capture_rate_button.grid(row=5,column=4,sticky=tk.E+tk.W)
         self.use_histogram_check.grid(row=5,column=5,sticky=tk.E+tk.W)
+        self.use_mle_check.grid(row=6,column=4,sticky=tk.E+tk.W)
+        self.censor_gaps_check.grid(row=6,column=5,sticky=tk.E+tk.W)
+        self.rate_window_label.grid(row=6,column=0,sticky=tk.E+tk.W)
+        self.rate_window_entry.grid(row=6,column=1,sticky=tk.E+tk.W)
+        self.rate_step_label.grid(row=6,column=2,sticky=tk.E+tk.W)
+        self.rate_step_entry.grid(row=6,column=3,sticky=tk.E+tk.W)
+        self.rate_time_button.grid(row=7,column=4,columnspan=2,sticky=tk.E+tk.W)
+        self.density_plot_check.grid(row=7,column=0,sticky=tk.E+tk.W)
+        self.sparse_export_check.grid(row=7,column=1,sticky=tk.E+tk.W)
 
 
         parent.bind("<Control-Key>", self.key_press)
@@ -224,7 +267,7 @@ class App(tk.Frame):
         self.event_toolbar.update()
         self.event_info_string = tk.StringVar()
         self.event_index = tk.IntVar()
-        self.event_index.set(self.eventsdb_subset['Subset 0']['id'][0])
+        self.event_index.set(self.eventsdb_subset['Subset 0'].ids()[0])
         self.event_entry = tk.Entry(self.events_frame, textvariable=self.event_index)
         self.plot_event_button = tk.Button(self.events_frame,text='Plot Event',command=self.plot_event)
         self.next_event_button = tk.Button(self.events_frame,text='Next',command=self.next_event)
@@ -236,6 +279,15 @@ class App(tk.Frame):
         self.event_info_display = tk.Label(self.events_frame, textvariable=self.event_info_string)
         self.plot_bad_events = tk.IntVar(0)
         self.plot_bad_events_check = tk.Checkbutton(self.events_frame, text='Plot Bad Events', variable = self.plot_bad_events)
+        self.prefetch_label = tk.Label(self.events_frame, text='Prefetch Events:')
+        self.prefetch_depth = tk.IntVar()
+        self.prefetch_depth.set(10)
+        self.prefetch_entry = tk.Entry(self.events_frame, textvariable=self.prefetch_depth)
+        self.cache_label = tk.Label(self.events_frame, text='Cache Size (MB):')
+        self.cache_mb = tk.IntVar()
+        self.cache_mb.set(256)
+        self.cache_entry = tk.Entry(self.events_frame, textvariable=self.cache_mb)
+        self.trace_cache = TraceCache(self.read_event_trace, self.cache_mb.get()*2**20)
         
         self.event_toolbar_frame.grid(row=1,column=0,columnspan=6)
         self.event_canvas.get_tk_widget().grid(row=0,column=0,columnspan=6)
@@ -254,6 +306,10 @@ class App(tk.Frame):
         self.delete_event_button.grid(row=5,column=0,columnspan=2,sticky=tk.E+tk.W)
         self.replicate_delete.grid(row=5,column=2,columnspan=2,sticky=tk.E+tk.W)
         self.plot_bad_events_check.grid(row=4,column=4,columnspan=2,stick=tk.E+tk.W)
+        self.prefetch_label.grid(row=6,column=0,sticky=tk.E+tk.W)
+        self.prefetch_entry.grid(row=6,column=1,sticky=tk.E+tk.W)
+        self.cache_label.grid(row=6,column=2,sticky=tk.E+tk.W)
+        self.cache_entry.grid(row=6,column=3,sticky=tk.E+tk.W)
         
         
 
@@ -273,8 +329,17 @@ class App(tk.Frame):
         self.reset_button = tk.Button(self.db_frame,text='Reset Subset',command=self.reset_db)
         self.draw_subset_details_button = tk.Button(self.db_frame, text='Display Filters', command=self.display_filters)
         self.save_subset_button = tk.Button(self.db_frame,text='Save Subset',command=self.save_subset)
+        self.subset_format = tk.StringVar()
+        self.subset_format.set(subset_extensions[0])
+        self.subset_format_option = tk.OptionMenu(self.db_frame, self.subset_format, *subset_extensions)
         self.remove_nonconsecutive_button = tk.Button(self.db_frame,text='Remove Non-Consecutive',command=self.remove_nonconsecutive_events)
         self.filter_entry = tk.Entry(self.db_frame)
+        self.sql_filter = tk.IntVar()
+        self.sql_filter_check = tk.Checkbutton(self.db_frame, text='SQL WHERE', variable=self.sql_filter)
+        self.save_session_button = tk.Button(self.db_frame,text='Save Session',command=self.save_session)
+        self.undo_button = tk.Button(self.db_frame,text='Undo',command=self.undo)
+        self.redo_button = tk.Button(self.db_frame,text='Redo',command=self.redo)
+        self.load_session_button = tk.Button(self.db_frame,text='Load Session',command=self.load_session)
 
         
         self.db_frame.grid(row=2,column=0,columnspan=6,sticky=tk.E+tk.W+tk.S+tk.N)
@@ -286,6 +351,12 @@ class App(tk.Frame):
         self.save_subset_button.grid(row=2,column=0,columnspan=2,sticky=tk.E+tk.W)
         self.draw_subset_details_button.grid(row=2,column=2,columnspan=2,sticky=tk.E+tk.W)
         self.remove_nonconsecutive_button.grid(row=2,column=4,columnspan=2,sticky=tk.E+tk.W)
+        self.sql_filter_check.grid(row=3,column=0,columnspan=2,sticky=tk.W)
+        self.save_session_button.grid(row=3,column=2,columnspan=2,sticky=tk.E+tk.W)
+        self.load_session_button.grid(row=3,column=4,columnspan=2,sticky=tk.E+tk.W)
+        self.subset_format_option.grid(row=4,column=0,columnspan=2,sticky=tk.E+tk.W)
+        self.undo_button.grid(row=4,column=2,columnspan=2,sticky=tk.E+tk.W)
+        self.redo_button.grid(row=4,column=4,columnspan=2,sticky=tk.E+tk.W)
 
         #Folder widgets
 
@@ -324,6 +395,11 @@ class App(tk.Frame):
         self.min_cluster_pts_entry = tk.Entry(self.cluster_controls_frame, textvariable=self.min_cluster_pts)
         self.min_pts_entry = tk.Entry(self.cluster_controls_frame, textvariable=self.min_pts)
         self.eps_entry = tk.Entry(self.cluster_controls_frame, textvariable=self.eps)
+        self.subsample_cluster = tk.IntVar()
+        self.subsample_cluster_check = tk.Checkbutton(self.cluster_controls_frame, text='Subsample', variable=self.subsample_cluster)
+        self.cluster_sample_size = tk.IntVar()
+        self.cluster_sample_size.set(50000)
+        self.cluster_sample_size_entry = tk.Entry(self.cluster_controls_frame, textvariable=self.cluster_sample_size)
 
 
         self.feature_col_options = []
@@ -382,6 +458,8 @@ class App(tk.Frame):
         self.min_cluster_pts_entry.grid(row=0,column=1,columnspan=2,sticky=tk.E+tk.W)
         self.min_pts_entry.grid(row=1,column=1,columnspan=2,sticky=tk.E+tk.W)
         self.eps_entry.grid(row=2,column=1,columnspan=2,sticky=tk.E+tk.W)
+        self.subsample_cluster_check.grid(row=1,column=3,sticky=tk.E+tk.W)
+        self.cluster_sample_size_entry.grid(row=1,column=4,sticky=tk.E+tk.W)
 
 
         sept = ttk.Separator(self.cluster_controls_frame, orient='horizontal')
@@ -427,6 +505,13 @@ class App(tk.Frame):
 
 #######################################
 
+    def clustering(self):
+        clustering = timed_import('clustering')
+        if self.tree_cache is None:
+            self.feature_cache = clustering.FeatureCache()
+            self.tree_cache = clustering.TreeCache()
+        return clustering
+
     def update_cluster(self):
         plotsum = 0
         indices = []
@@ -440,64 +525,46 @@ class App(tk.Frame):
             return
         subset = self.cluster_subset_option.cget('text')
 
-        features = len(self.feature_options)
-        
+        db = self.eventsdb_subset[subset]
+        baseline = bool(self.include_baseline.get())
+        loader = lambda name: self.parse_db_col(name, subset)
+        def feature_key(i, norm):
+            label = self.feature_options[i].cget('text')
+            name = self.unalias_dict.get(label,label)
+            return (name, bool(self.feature_options_log[i].get()), norm, db.column_version(name), baseline)
+
         logscale_x = self.feature_options_log[indices[0]].get()
         logscale_y = self.feature_options_log[indices[1]].get()
         x_label = self.feature_options[indices[0]].cget('text')
         y_label = self.feature_options[indices[1]].cget('text')
-        x_col = np.squeeze(np.array(self.parse_db_col(self.unalias_dict.get(x_label,x_label),subset)))
-        y_col = np.squeeze(np.array(self.parse_db_col(self.unalias_dict.get(y_label,y_label),subset)))
-        xsign = np.sign(np.average(x_col))
-        ysign = np.sign(np.average(y_col))
-        x = np.log10(xsign*x_col) if bool(logscale_x) else x_col
-        y = np.log10(ysign*y_col) if bool(logscale_y) else y_col
-       
+        clustering = self.clustering()
+        x = self.feature_cache.column(feature_key(indices[0], 'None'), loader)
+        y = self.feature_cache.column(feature_key(indices[1], 'None'), loader)
+
         if plotsum == 3:
             logscale_z = self.feature_options_log[indices[2]].get()
             z_label = self.feature_options[indices[2]].cget('text')
-            z_col = np.squeeze(np.array(self.parse_db_col(self.unalias_dict.get(z_label,z_label),subset)))
-            zsign = np.sign(np.average(z_col))
-            z = np.log10(zsign*z_col) if bool(logscale_z) else z_col
-
-        data = []
-        for i in range(features):
-            norm = self.norm_options[i].cget('text')
-            logscale = self.feature_options_log[i].get()
-            label = self.feature_options[i].cget('text')
-            col = np.squeeze(np.array(self.parse_db_col(self.unalias_dict.get(label,label),subset)))
-            col = col.astype(np.float64)
-            sign = np.sign(np.average(col))
-            col = np.log10(sign*col) if bool(logscale) else col
-            if norm == 'Max':
-                col -= np.average(col)
-                col /= np.max(np.absolute(col))
-            elif norm == 'Gauss':
-                col -= np.average(col)
-                col /= np.std(col)
-            elif norm == 'MAD':
-                col -= np.average(col)
-                mad = np.median([np.absolute(x-np.average(col)) for x in col])
-                col /= mad
-            elif norm == 'None':
-                pass
-            data.append(col)
-        data = np.vstack(data).T
+            z = self.feature_cache.column(feature_key(indices[2], 'None'), loader)
 
+        keys = [feature_key(i, self.norm_options[i].cget('text')) for i in range(len(self.feature_options))]
+        data = self.feature_cache.matrix(keys, loader)
 
-        
         ##perform clustering
-        clusterer = hdbscan.HDBSCAN(min_cluster_size=self.min_cluster_pts.get(), min_samples=self.min_pts.get(), gen_min_span_tree=True, cluster_selection_epsilon=self.eps.get())
-        clusterer.fit(data)
-        palette = sns.color_palette()
-        cluster_colors = [sns.desaturate(palette[col], sat)
-                  if col >= 0 else (0,0,0) for col, sat in
-                  zip(clusterer.labels_, clusterer.probabilities_)]
+        if self.subsample_cluster.get():
+            ##rows are in id order, so equal blocks of rows are stretches of the recording
+            strata = np.arange(len(data))*cluster_strata//max(len(data),1)
+            labels, probabilities, refit = clustering.subsample_fit(self.tree_cache, tuple(keys), data, strata, self.cluster_sample_size.get(), self.min_cluster_pts.get(), self.min_pts.get(), self.eps.get())
+        else:
+            clusterer, refit = self.tree_cache.fit(tuple(keys), data, self.min_cluster_pts.get(), self.min_pts.get(), self.eps.get())
+            labels, probabilities = clusterer.labels_, clusterer.probabilities_
+        self.status_string.set('{0}: {1} clusters{2}'.format(subset, len(set(labels) - set([-1])), '' if refit else ' (reselected from cached tree)'))
+        colors = clustering.cluster_colors(labels, probabilities, timed_import('seaborn').color_palette())
         #clusterer._min_samples_label = 0
 
         
         self.cluster_f.clf()
         if plotsum == 3:
+            timed_import('mpl_toolkits.mplot3d')
             ax = self.cluster_f.add_subplot(111, projection = '3d')
         else:
             ax = self.cluster_f.add_subplot(111)
@@ -516,17 +583,20 @@ class App(tk.Frame):
             if logscale_z:
                 ax.set_ylabel('Log(' +str(y_label)+')', labelpad=labelpad, fontsize=fontsize)
         if plotsum == 3:
-            ax.scatter(x, y, z, c=cluster_colors, **plot_kwds)
+            ax.scatter(x, y, z, c=colors, **plot_kwds)
             ax.tick_params(axis='x', labelsize=labelsize)
             ax.tick_params(axis='y', labelsize=labelsize)
             ax.tick_params(axis='z', labelsize=labelsize)
         else:
-            ax.scatter(x, y, c=cluster_colors, **plot_kwds)
+            ax.scatter(x, y, c=colors, **plot_kwds)
             ax.tick_params(axis='x', labelsize=labelsize)
             ax.tick_params(axis='y', labelsize=labelsize)
         self.cluster_canvas.draw()
 
-        self.eventsdb_subset[subset]['cluster_id'] = clusterer.labels_
+        before = self.subset_state(subset)
+        self.eventsdb_subset[subset].set_col('cluster_id', labels)
+        self.eventsdb_subset[subset].set_col('cluster_probability', probabilities)
+        self.record_change([subset], {subset: before})
         
 
 
@@ -630,12 +700,14 @@ class App(tk.Frame):
 
     def declare_good_events(self):
         subset = self.subset_option.cget('text')
-        [a,b] = self.eventsdb_subset[subset].shape
+        a = len(self.eventsdb_subset[subset])
         if 'Nonconsecutive Events Removed' not in self.filter_list[subset]:
-            self.eventsdb_subset[subset]['index_ref'] = np.arange(0,a)
+            before = {subset: self.subset_state(subset)}
+            self.eventsdb_subset[subset].set_col('index_ref', np.arange(0,a))
             if subset in self.good_event_subset:
                 self.good_event_subset.remove(subset)
             self.good_event_subset.insert(0,subset)
+            self.record_change([subset], before)
             self.status_string.set(', '.join(self.good_event_subset)+' events are all considered successful')
 
         else:
@@ -663,22 +735,18 @@ class App(tk.Frame):
             self.status_string.set('Cannot remove non-consecutive events twice. To apply further filters, reset the subset and start over')
             self.status_display.flash(6)
         else:
-            self.capture_rate_subset[subset] = self.eventsdb_subset[subset]
-            indices = self.eventsdb_subset[subset]['id'].values
-            index_diff = np.diff(indices)
-            index_diff = np.insert(index_diff,0,0)
-            self.eventsdb_subset[subset]['index_diff'] = index_diff
-            db = self.eventsdb_subset[subset]
-            self.eventsdb_subset[subset] = sqldf('SELECT * from db where  index_diff = 1',locals())
+            before = self.subset_state(subset)
+            self.capture_rate_subset[subset] = self.eventsdb_subset[subset].copy()
+            self.eventsdb_subset[subset].remove_nonconsecutive()
             self.status_string.set('{0}: {1} events'.format(subset, len(self.eventsdb_subset[subset])))
+            self.subset_changed()
             self.filter_list[subset].append('Nonconsecutive Events Removed')
+            self.record_change([subset], {subset: before})
         
     def update_count(self, *args):
         subset = self.subset_option.cget('text')
-        try:
-            self.status_string.set('{0}: {1} events'.format(subset,len(self.eventsdb_subset[subset])))
-        except TypeError:
-            self.status_string.set('Empty subset, try resetting')
+        self.status_string.set('{0}: {1} events'.format(subset,len(self.eventsdb_subset[subset])))
+        self.subset_changed()
 
     def ln_exponential(self, t, rate, amplitude): #define a fitting function form
         return np.log(amplitude)-rate*t
@@ -695,27 +763,17 @@ class App(tk.Frame):
         self.ydata = []
         fit_string = ''
         self.export_type = 'capture_rate'
+        if self.use_mle.get():
+            self.capture_rate_mle(subset_list)
+            return
         for subset in subset_list:
-            if 'Nonconsecutive Events Removed' not in self.filter_list[subset]:
-                db = self.eventsdb_subset[subset]
-            else:
-                db = self.capture_rate_subset[subset]
-
-            start_times = db['start_time_s'].values
-            delays = np.diff(start_times)                        
-            indices = db['id'].values
-            index_diff = np.diff(indices)
-            if 'index_ref' in db:
-                ref_indices = db['index_ref']
-                ref_indices_diff = np.diff(ref_indices)
-                valid_delays = np.sort(delays[np.where((index_diff - ref_indices_diff) == 0)])
-            else:
-                valid_delays = np.sort(delays[np.where(index_diff == 1)])
+            db = self.capture_rate_db(subset)
+            indices = db.ids()
+            valid_delays, probability = survival(interevent_delays(db)[0], np.zeros(0))
 
             if not self.use_histogram.get():
-                probability = np.squeeze(np.array([1.0-float(i)/float(len(valid_delays)) for i in range(len(valid_delays))]))
                 lnprob = np.log(probability)
-                popt, pcov = curve_fit(self.ln_exponential, valid_delays, lnprob)
+                popt, pcov = timed_import('scipy.optimize').curve_fit(self.ln_exponential, valid_delays, lnprob)
                 fit = np.exp(self.ln_exponential(valid_delays, popt[0], popt[1]))
 
                 residuals = lnprob - np.log(fit)
@@ -729,7 +787,7 @@ class App(tk.Frame):
                 self.a.plot(valid_delays,probability,'.',label='{0}'.format(subset))
                 self.a.plot(valid_delays,fit,label='{0} Fit'.format(subset))
                 self.a.set_yscale('log')
-                fit_string = fit_string + '{0}: {1}/{2} events used. Capture Rate is {3:.3g} \u00B1 {4:.1g} Hz (R\u00B2 = {5:.2g})\n'.format(subset,len(valid_delays),len(indices), popt[0], -t.isf(0.975,len(valid_delays))*np.sqrt(np.diag(pcov))[0], rsquared)
+                fit_string = fit_string + '{0}: {1}/{2} events used. Capture Rate is {3:.3g} \u00B1 {4:.1g} Hz (R\u00B2 = {5:.2g})\n'.format(subset,len(valid_delays),len(indices), popt[0], -timed_import('scipy.stats').t.isf(0.975,len(valid_delays))*np.sqrt(np.diag(pcov))[0], rsquared)
                 self.xdata.append(valid_delays)
                 self.ydata.append(probability)
                 self.a.legend(loc='best',prop={'size': 10})
@@ -743,7 +801,7 @@ class App(tk.Frame):
                 self.xdata.append(bincenters)
                 self.ydata.append(counts)
 
-                popt, pcov = curve_fit(self.log_exp_pdf, bincenters, counts)
+                popt, pcov = timed_import('scipy.optimize').curve_fit(self.log_exp_pdf, bincenters, counts)
                 fit = self.log_exp_pdf(bincenters, popt[0], popt[1])
 
                 residuals = fit - counts
@@ -756,11 +814,67 @@ class App(tk.Frame):
                 self.a.set_ylabel('Count')
                 self.a.plot(bincenters,counts,drawstyle='steps-mid',label='{0}'.format(subset))
                 self.a.plot(bincenters,fit,label='{0} Fit'.format(subset))
-                fit_string = fit_string + '{0}: {1}/{2} events used. Capture Rate is {3:.3g} \u00B1 {4:.1g} Hz (R\u00B2 = {5:.2g})\n'.format(subset,len(valid_delays),len(indices), popt[0], -t.isf(0.975,len(counts))*np.sqrt(np.diag(pcov))[0], rsquared)
+                fit_string = fit_string + '{0}: {1}/{2} events used. Capture Rate is {3:.3g} \u00B1 {4:.1g} Hz (R\u00B2 = {5:.2g})\n'.format(subset,len(valid_delays),len(indices), popt[0], -timed_import('scipy.stats').t.isf(0.975,len(counts))*np.sqrt(np.diag(pcov))[0], rsquared)
                 self.a.legend(loc='best',prop={'size': 10})
                 self.canvas.draw()
                 self.status_string.set(fit_string)
         
+    def capture_rate_db(self, subset):
+        if 'Nonconsecutive Events Removed' not in self.filter_list[subset]:
+            return self.eventsdb_subset[subset]
+        return self.capture_rate_subset[subset]
+
+    def capture_rate_mle(self, subset_list):
+        censor = bool(self.censor_gaps.get())
+        databases = [self.capture_rate_db(subset) for subset in subset_list]
+        groups = [interevent_delays(db, censor) for db in databases]
+        rates, lower, upper = capture_rates(groups)
+        fit_string = ''
+        self.a.set_xlabel('Interevent Delay (s)')
+        self.a.set_ylabel('Probability')
+        for subset, db, (delays, censored), rate, low, high in zip(subset_list, databases, groups, rates, lower, upper):
+            valid_delays, probability = survival(delays, censored)
+            self.a.plot(valid_delays,probability,'.',label='{0}'.format(subset))
+            self.a.plot(valid_delays,np.exp(-rate*valid_delays),label='{0} MLE'.format(subset))
+            censored_string = ' ({0} censored)'.format(len(censored)) if censor else ''
+            fit_string = fit_string + '{0}: {1}/{2} events used{3}. Capture Rate is {4:.3g} Hz (95% CI {5:.3g} - {6:.3g})\n'.format(subset,len(delays),len(db),censored_string,rate,low,high)
+            self.xdata.append(valid_delays)
+            self.ydata.append(probability)
+        self.a.set_yscale('log')
+        self.a.legend(loc='best',prop={'size': 10})
+        self.canvas.draw()
+        self.status_string.set(fit_string)
+
+    def capture_rate_time(self):
+        try:
+            window = float(self.rate_window_entry.get())
+            step = float(self.rate_step_entry.get())
+        except ValueError:
+            self.status_string.set('Window and step must be numbers of seconds')
+            self.status_display.flash(6)
+            return
+        subset_list = self.get_active_subsets(0)
+        censor = bool(self.censor_gaps.get())
+        self.f.clf()
+        self.a = self.f.add_subplot(111)
+        self.xdata = []
+        self.ydata = []
+        self.zdata = []
+        self.export_type = 'capture_rate_time'
+        fit_string = ''
+        for subset in subset_list:
+            centers, rates, errors, events = windowed_capture_rate(self.capture_rate_db(subset), window, step, censor)
+            self.a.errorbar(centers, rates, yerr=errors, fmt='.-', label='{0}'.format(subset))
+            self.xdata.append(centers)
+            self.ydata.append(rates)
+            self.zdata.append(errors)
+            fit_string = fit_string + '{0}: {1} windows, capture rate {2:.3g} - {3:.3g} Hz\n'.format(subset, len(centers), np.nanmin(rates) if len(rates) > 0 else np.nan, np.nanmax(rates) if len(rates) > 0 else np.nan)
+        self.a.set_xlabel('Time (s)')
+        self.a.set_ylabel('Capture Rate (Hz)')
+        self.a.legend(loc='best',prop={'size': 10})
+        self.canvas.draw()
+        self.status_string.set(fit_string)
+
     def not_implemented(self):
         top = tk.Toplevel()
         top.title('Not Implemented Warning')
@@ -770,49 +884,46 @@ class App(tk.Frame):
     def filter_db(self):
         filterstring = self.filter_entry.get()
         subset = self.subset_option.cget('text')
-        self.eventsdb_prev = self.eventsdb_subset[subset]
-        eventsdb_subset = self.eventsdb_subset[subset]
+        before = self.subset_state(subset)
         if 'Nonconsecutive Events Removed' in self.filter_list[subset]:
             self.status_string.set('Cannot apply filters after removing non-consecutive events. To apply further filters, reset the subset and start over')
         else:
-            self.eventsdb_subset[subset] = eventsdb_subset.query(filterstring)
-            self.eventsdb_subset[subset]['adj_id'] = np.arange(0,len(self.eventsdb_subset[subset]))
             try:
-                self.status_string.set('{0}: {1} events'.format(subset,len(self.eventsdb_subset[subset])))
-                if filterstring not in self.filter_list[subset]:
-                    self.filter_list[subset].append(filterstring)
+                if self.sql_filter.get():
+                    self.eventsdb_subset[subset].keep(self.sql_session.where(self.eventsdb_subset[subset], filterstring))
+                    filterstring = sql_prefix + filterstring
                 else:
-                    self.status_string.set('Redundant Filter Ignored')
-            except TypeError:
+                    self.eventsdb_subset[subset].query(filterstring, self.ragged)
+            except Exception:
                 self.status_string.set('Invalid Entry')
                 self.status_display.flash(6)
-                self.eventsdb_subset[subset] = self.eventsdb_prev
+                self.eventsdb_subset[subset] = before.db
+                return
+            self.eventsdb_subset[subset].set_col('adj_id', np.arange(0,len(self.eventsdb_subset[subset])))
+            self.status_string.set('{0}: {1} events'.format(subset,len(self.eventsdb_subset[subset])))
+            self.subset_changed()
+            if filterstring not in self.filter_list[subset]:
+                self.filter_list[subset].append(filterstring)
+            else:
+                self.status_string.set('Redundant Filter Ignored')
+            self.record_change([subset], {subset: before})
         
     def replicate_manual_deletions(self):
         subset_list = self.get_active_subsets(1)
 
+        manual_delete = self.eventsdb['id'].values[self.manual_delete]
+        before = dict((subset, self.subset_state(subset)) for subset in subset_list)
         for subset in subset_list:
-            self.eventsdb_prev = self.eventsdb_subset[subset]
-            eventsdb_subset = self.eventsdb_subset[subset]
-            self.eventsdb_subset[subset]
-            manual_delete = self.manual_delete
-            tempdict = dict()
-            tempdict['deleted_id'] = manual_delete
-            temptable = pd.DataFrame(tempdict)
-            tempdb = sqldf('''SELECT * FROM eventsdb_subset t1 LEFT JOIN temptable t2 ON t1.id = t2.deleted_id''', locals())
-            tempdb['deleted_id'].fillna(-1,inplace=True)
-            self.eventsdb_subset[subset] = sqldf('''SELECT * FROM tempdb where deleted_id = -1''',locals())
-            self.eventsdb_subset[subset].drop('deleted_id',1,inplace=True)
-            try:
-                self.status_string.set('{0}: {1} events'.format(subset,len(self.eventsdb_subset[subset])))
-                for event in manual_delete:
-                    filterstring = 'id != {0}'.format(event)
-                    if filterstring not in self.filter_list[subset]:
-                        self.filter_list[subset].append(filterstring)
-                
-            except TypeError:
-                self.status_string.set('Unable to replicate deletions')
-                self.eventsdb_subset[subset] = self.eventsdb_prev
+            db = self.eventsdb_subset[subset]
+            db.keep(~self.manual_delete[db.rows])
+            self.status_string.set('{0}: {1} events'.format(subset,len(db)))
+            self.subset_changed()
+            existing = set(self.filter_list[subset])
+            for event in manual_delete:
+                filterstring = 'id != {0}'.format(event)
+                if filterstring not in existing:
+                    self.filter_list[subset].append(filterstring)
+        self.record_change(subset_list, before)
     
     def display_filters(self):
         top = tk.Toplevel()
@@ -840,45 +951,54 @@ class App(tk.Frame):
             i += 1
 
 
-    def first_level_fraction(self):
-        durations = [np.array(a,dtype=float)[1:-1] for a in self.eventsdb['level_duration_us'].str.split(';')]
-        fraction = [duration[0]/(np.sum(duration)+duration[0]) for duration in durations]
-        self.eventsdb['first_level_fraction'] = fraction
-        for key, val in self.eventsdb_subset.items():
-            val = self.eventsdb
-        
-    def folding_distribution(self):
-        x = self.eventsdb['max_blockage_duration_us']/(self.eventsdb['duration_us']+self.eventsdb['max_blockage_duration_us'])
-        self.eventsdb['folding'] = x
-        for key, val in self.eventsdb_subset.items():
-            val = self.eventsdb
-
-
-    def count(self):
-        eventsdb = self.eventsdb
-        eventsdb_sorted = sqldf('SELECT * from eventsdb ORDER BY id',locals())
-        numevents = len(eventsdb)
-        count = [i for i in range(0,numevents)]
-        eventsdb_sorted['count'] = count
-        self.eventsdb = sqldf('SELECT * from eventsdb_sorted ORDER BY id',locals())
-        for key, val in self.eventsdb_subset.items():
-            val = self.eventsdb
-        
-                
-    
-
     def reset_db(self):
         subset = self.subset_option.cget('text')
-        self.eventsdb_subset[subset] = self.eventsdb
+        before = self.subset_state(subset)
+        self.eventsdb_subset[subset] = Subset(self.eventsdb)
         self.capture_rate_subset[subset] = None
         self.filter_list[subset] = []
         self.status_string.set('{0}: {1} events'.format(subset,len(self.eventsdb_subset[subset])))
+        self.subset_changed()
         if subset in self.good_event_subset:
             self.good_event_subset.remove(subset)
+        self.record_change([subset], {subset: before})
+
+    def subset_state(self, subset):
+        return SubsetState(self.eventsdb_subset[subset].copy(), list(self.filter_list[subset]), self.capture_rate_subset[subset], subset in self.good_event_subset)
+
+    def set_subset_state(self, subset, state):
+        self.eventsdb_subset[subset] = state.db
+        self.filter_list[subset] = state.filters
+        self.capture_rate_subset[subset] = state.capture_rate
+        if subset in self.good_event_subset and not state.good:
+            self.good_event_subset.remove(subset)
+        elif state.good and subset not in self.good_event_subset:
+            self.good_event_subset.insert(0,subset)
+
+    def record_change(self, subset_list, before):
+        self.history.push(SubsetChange([(subset, before[subset], self.subset_state(subset)) for subset in subset_list], len(self.eventsdb)))
+
+    def undo(self):
+        if self.history.undo(self):
+            self.subset_changed()
+            subset = self.subset_option.cget('text')
+            self.status_string.set('{0}: {1} events. {2}'.format(subset, len(self.eventsdb_subset[subset]), self.history.stats()))
+        else:
+            self.status_string.set('Nothing to undo')
+
+    def redo(self):
+        if self.history.redo(self):
+            self.subset_changed()
+            subset = self.subset_option.cget('text')
+            self.status_string.set('{0}: {1} events. {2}'.format(subset, len(self.eventsdb_subset[subset]), self.history.stats()))
+        else:
+            self.status_string.set('Nothing to redo')
 
 
     def export_plot_data(self):
-        data_path = tkinter.filedialog.asksaveasfilename(defaultextension='.csv')
+        data_path = tkinter.filedialog.asksaveasfilename(defaultextension='.csv', filetypes=[('CSV','*.csv'),('NumPy archive','*.npz'),('Parquet','*.parquet'),('Feather','*.feather')])
+        if not data_path:
+            return
         subset_list = self.get_active_subsets(0)
         if self.export_type == 'hist1d':
             data = OrderedDict()
@@ -897,39 +1017,32 @@ class App(tk.Frame):
                     x_label = 'Log({0})'.format(x_label)
                 data[x_label] = self.xdata
                 data['{0} Count'.format(subset_list[0])] = self.ydata
-            data_frame = pd.DataFrame(data)
-            data_frame.to_csv(data_path, index=False)
+            self.write_plot_data(data_path, data)
         elif self.export_type == 'scatter':
             x_label = self.x_option.cget('text')
             y_label = self.y_option.cget('text')
             data = OrderedDict()
-            data_frame = pd.DataFrame()
-            column_names = []
             for i in range(len(subset_list)):
                 x_string = '{0}_{1}'.format(subset_list[i],x_label)
                 y_string = '{0}_{1}'.format(subset_list[i],y_label)
-                column_names.append(x_string)
-                column_names.append(y_string)
                 if len(subset_list) > 1:
                     data[x_string] = self.xdata[i]
                     data[y_string] = self.ydata[i]
                 else:
                     data[x_string] = self.xdata
                     data[y_string] = self.ydata
-                data_frame = pd.concat([data_frame, pd.DataFrame(data[x_string]), pd.DataFrame(data[y_string])],axis=1)
-            data_frame.columns = column_names
-            data_frame.to_csv(data_path, index=False)
+            self.write_plot_data(data_path, data)
         elif self.export_type == 'hist2d':
             data = OrderedDict()
             logscale_x = self.x_log_var.get()
             logscale_y = self.y_log_var.get()
             x_label = self.x_option.cget('text')
             y_label = self.y_option.cget('text')
-            data[x_label] = self.xdata
-            data[y_label] = self.ydata
-            data['Count'] = self.zdata
-            data_frame = pd.DataFrame(data)
-            data_frame.to_csv(data_path, index=False)
+            keep = self.zdata > 0 if self.sparse_export.get() else slice(None)
+            data[x_label] = self.xdata[keep]
+            data[y_label] = self.ydata[keep]
+            data['Count'] = self.zdata[keep]
+            self.write_plot_data(data_path, data)
         elif self.export_type == 'capture_rate':
             data = OrderedDict()
             column_names = []
@@ -939,14 +1052,37 @@ class App(tk.Frame):
                     
                 data[x_string] = self.xdata[i]
                 data[y_string] = self.ydata[i]
-            data_frame = pd.DataFrame({k : pd.Series(v) for k,v in data.items()})
-            data_frame.to_csv(data_path, index=False)
+            self.write_plot_data(data_path, data)
+        elif self.export_type == 'capture_rate_time':
+            data = OrderedDict()
+            for i in range(len(subset_list)):
+                data['{0} Time (s)'.format(subset_list[i])] = self.xdata[i]
+                data['{0} Capture Rate (Hz)'.format(subset_list[i])] = self.ydata[i]
+                data['{0} Capture Rate Error (Hz)'.format(subset_list[i])] = self.zdata[i]
+            self.write_plot_data(data_path, data)
         else:
             self.status_string.set("Unable to export plot")
 
     
 
 
+    def write_plot_data(self, data_path, data):
+        ##columns of different lengths are padded in csv, parquet and feather files and stored as separate arrays in npz files
+        extension = os.path.splitext(data_path)[1].lower()
+        if extension == '.npz':
+            np.savez(data_path, **OrderedDict((k, np.asarray(v)) for k,v in data.items()))
+            return
+        frame = pd.DataFrame(OrderedDict((k, pd.Series(v)) for k,v in data.items()))
+        try:
+            if extension == '.parquet':
+                frame.to_parquet(data_path, index=False)
+            elif extension == '.feather':
+                frame.to_feather(data_path)
+            else:
+                frame.to_csv(data_path, index=False)
+        except ImportError:
+            self.status_string.set('Parquet and Feather export need pyarrow')
+
     def on_click(self, event):
         if self.clicks_remaining > 0:
             if event.inaxes is not None:
@@ -991,18 +1127,7 @@ class App(tk.Frame):
         if self.clicks_remaining > 0:
             self.status_string.set('Complete State Array First: {0} clicks remaining'.format(self.clicks_remaining))
         else:
-            type_array = []
-            trimmed_type = []
-            trimmed_Nlev = []
-            first_level=[]
-            last_level=[]
-            state_means = np.zeros(self.num_states)
-            i = 0
-            while i < self.num_states*2:
-                state_means[i/2] = 0.5*(self.state_array[i]+self.state_array[i+1])
-                i += 2
-
-
+            state_means = np.mean(np.reshape(self.state_array,(self.num_states,2)),axis=1)
 
             x = self.xdata
             y = self.ydata
@@ -1013,54 +1138,29 @@ class App(tk.Frame):
                 p0.append(state_means[i])
                 p0.append(1.0/6.0 * (self.state_array[2*i+1]-self.state_array[2*i]))
             
-            popt, pcov = curve_fit(lambda x, *p0: self.multi_gauss(x, self.num_states, p0), x, y, p0=p0)
+            popt, pcov = timed_import('scipy.optimize').curve_fit(lambda x, *p0: self.multi_gauss(x, self.num_states, p0), x, y, p0=p0)
 
             self.plot_1d_histogram()
             self.a.plot(x, self.multi_gauss(x, self.num_states,popt))
             self.canvas.draw()
             
-            blockage_levels = [np.array(a,dtype=float)[1:-1] for a in self.eventsdb_subset[subset]['blockages_pA'].str.split(';')]
-            for b in blockage_levels:
-                event_type = []
-                indices = [(np.abs(state_means - blevel)).argmin() for blevel in b]
-                for level,index in zip(b,indices):
-                    if level > self.state_array[2*index] and level < self.state_array[2*index+1]:
-                        event_type.append(index+1)
-                    else:
-                        event_type = [-1]
-                        break
-                typenum = int(''.join(map(str, event_type)))
-                trim_type = []
-                if typenum == -1:
-                    trim_type.append('-1')
-                    trim_type = int(''.join(map(str, trim_type)))
-                    trimmed_Nlev.append(0)
-                else:
-                    str_typenum = str(typenum)
-                    for i in range(len(str_typenum)-1):
-                        if int(str_typenum[i]) != int(str_typenum[i+1]):
-                            trim_type.append(str_typenum[i])
-                    trim_type.append(str_typenum[-1])
-                    trimmed_Nlev.append(len(trim_type))
-                    trim_type = int(''.join(map(str, trim_type)))
-                trimmed_type.append(trim_type)
-                if typenum > 999999999:
-                    typenum = -1
-                type_array.append(typenum)
-                if typenum != -1:
-                    first_level.append(int(str(trim_type)[0]))
-                    last_level.append(int(str(trim_type)[-1]))
-                else:
-                    first_level.append(-1)
-                    last_level.append(-1)
-            self.eventsdb_subset[subset]['event_shape'] = type_array
-            self.eventsdb_subset[subset]['trimmed_shape'] = trimmed_type
-            self.eventsdb_subset[subset]['trimmed_n_levels'] = trimmed_Nlev
-            self.eventsdb_subset[subset]['first_level'] = first_level
-            self.eventsdb_subset[subset]['last_level'] = last_level
+            before = self.subset_state(subset)
+            db = self.eventsdb_subset[subset]
+            blockages = self.ragged['blockages_pA'].take(db.rows).strip_baseline()
+            try:
+                shapes = classify_shapes(blockages, self.state_array)
+            except ValueError:
+                self.status_string.set('State boundaries overlap, redefine blockage states')
+                self.status_display.flash(6)
+                return
+            for key, val in shapes.items():
+                db.set_col(key, val)
             self.status_string.set('Event shapes recalculated. \nThis applies only to the current subset')
-            self.eventsdb_subset[subset].loc[self.eventsdb_subset[subset]['event_shape'] == 1, 'folding'] = 0
-            self.eventsdb_subset[subset].loc[self.eventsdb_subset[subset]['event_shape'] == 2, 'folding'] = 0.5
+            folding = np.array(db.col('folding'), dtype=np.float64)
+            folding[db.col('event_shape') == 1] = 0
+            folding[db.col('event_shape') == 2] = 0.5
+            db.set_col('folding', folding)
+            self.record_change([subset], {subset: before})
 
     def apply_limits(self):
         x_min = float(self.x_min.get())
@@ -1124,6 +1224,12 @@ class App(tk.Frame):
     def key_press(self, event):
         if event.keysym == 'a':
             self.set_axis_limits()
+        elif event.keysym == 'i':
+            self.status_string.set(import_report())
+        elif event.keysym == 'z':
+            self.undo()
+        elif event.keysym == 'y':
+            self.redo()
 
     def plot_xy(self):
         subset_list = self.get_active_subsets(0)
@@ -1151,6 +1257,11 @@ class App(tk.Frame):
         self.xdata = np.array(x_col*xsign)
         self.ydata = np.array(y_col*ysign)
 
+        if self.density_plot.get():
+            xs = list(self.xdata) if len(subset_list) > 1 else [self.xdata]
+            ys = list(self.ydata) if len(subset_list) > 1 else [self.ydata]
+            self.plot_density(subset_list, xs, ys, logscale_x, logscale_y)
+            return
 
         if len(subset_list) > 1:
             for i in range(len(subset_list)):
@@ -1164,64 +1275,130 @@ class App(tk.Frame):
             self.a.set_yscale('log')
         self.canvas.draw()
 
+    def plot_density(self, subset_list, xs, ys, logscale_x, logscale_y):
+        ##points are binned into a count grid matching the axes in screen pixels and shown as one image,
+        ##re-binned from the current limits whenever they change
+        self.density_log = (bool(logscale_x), bool(logscale_y))
+        self.density_points = []
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for x, y in zip(xs, ys):
+                x = np.asarray(x, dtype=np.float64)
+                y = np.asarray(y, dtype=np.float64)
+                self.density_points.append((np.log10(x) if logscale_x else x, np.log10(y) if logscale_y else y))
+        limits = []
+        for axis, log in zip([0,1], self.density_log):
+            values = np.concatenate([p[axis][np.isfinite(p[axis])] for p in self.density_points])
+            lo, hi = (np.min(values), np.max(values)) if len(values) > 0 else (0.0, 1.0)
+            if hi <= lo:
+                lo, hi = lo - 0.5, hi + 0.5
+            limits.append((10**lo, 10**hi) if log else (lo, hi))
+        if logscale_x:
+            self.a.set_xscale('log')
+        if logscale_y:
+            self.a.set_yscale('log')
+        self.a.set_xlim(limits[0])
+        self.a.set_ylim(limits[1])
+        self.a.set_autoscale_on(False)
+        self.density_colors = [matplotlib.colors.to_rgb(c) for c in matplotlib.rcParams['axes.prop_cycle'].by_key()['color']]
+        if len(subset_list) > 1:
+            for i in range(len(subset_list)):
+                self.a.plot([],[],marker='s',linestyle='None',color=self.density_colors[i % len(self.density_colors)],label=subset_list[i])
+            self.a.legend(loc='best',prop={'size': 10})
+        self.density_axes = self.a
+        self.density_image = None
+        self.a.callbacks.connect('xlim_changed', self.request_density)
+        self.a.callbacks.connect('ylim_changed', self.request_density)
+        self.draw_density()
+
+    def request_density(self, *args):
+        if self.pending_density is None:
+            self.pending_density = self.after_idle(self.draw_density)
+
+    def draw_density(self):
+        self.pending_density = None
+        if self.density_axes is not self.a:
+            return
+        bbox = self.a.get_window_extent()
+        shape = (max(int(bbox.height),1), max(int(bbox.width),1))
+        xlim = np.log10(self.a.get_xlim()) if self.density_log[0] else np.array(self.a.get_xlim())
+        ylim = np.log10(self.a.get_ylim()) if self.density_log[1] else np.array(self.a.get_ylim())
+        grids = [density_grid(x, y, xlim, ylim, shape) for x, y in self.density_points]
+        if len(grids) == 1:
+            image = np.ma.masked_equal(grids[0], 0)
+            if self.density_image is None:
+                self.density_image = self.a.imshow(image, extent=(0,1,0,1), transform=self.a.transAxes, origin='lower', aspect='auto', interpolation='nearest', norm=matplotlib.colors.LogNorm())
+            else:
+                self.density_image.set_data(image)
+            self.density_image.set_clim(1, max(grids[0].max(), 2))
+        else:
+            image = composite(grids, [self.density_colors[i % len(self.density_colors)] for i in range(len(grids))])
+            if self.density_image is None:
+                self.density_image = self.a.imshow(image, extent=(0,1,0,1), transform=self.a.transAxes, origin='lower', aspect='auto', interpolation='nearest')
+            else:
+                self.density_image.set_data(image)
+        self.canvas.draw_idle()
+
+    def histogram_column(self, col, subset, logscale):
+        values = np.squeeze(np.array(self.parse_db_col(col, subset)))
+        if logscale:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = np.log10(np.sign(np.average(values))*values)
+        return values
+
+    def histogram_key(self, *args):
+        return args + (bool(self.include_baseline.get()),)
+
+    def compute_1d_histogram(self, col, subset_list, numbins, logscale_x, fold):
+        columns = [self.histogram_column(col, subset, logscale_x) for subset in subset_list]
+        edges = np.array([0,0.1,0.2,0.3,0.4,0.5]) if fold else shared_edges(columns, numbins)
+        return [histogram(values, edges) for values in columns], edges
+
     def plot_1d_histogram(self):
         subset_list = self.get_active_subsets(0)
         self.export_type = 'hist1d'
         logscale_x = self.x_log_var.get()
         logscale_y = self.y_log_var.get()
         x_label = self.x_option.cget('text')
-        col = np.squeeze(np.array([self.parse_db_col(self.unalias_dict.get(x_label,x_label),key) for key in subset_list]))
-        numbins = self.xbin_entry.get()
+        col = self.unalias_dict.get(x_label,x_label)
+        numbins = int(self.xbin_entry.get())
+        fold = x_label == 'Fold Fraction' and not logscale_x
+        versions = tuple((subset, self.eventsdb_subset[subset].column_version(col)) for subset in subset_list)
+        key = self.histogram_key('hist1d', col, numbins, bool(logscale_x), fold, versions)
+        counts, edges = self.histogram_cache.get(key, lambda: self.compute_1d_histogram(col, subset_list, numbins, logscale_x, fold))
         self.f.clf()
         self.a = self.f.add_subplot(111)
-        self.xdata = []
-        self.ydata = []
         labelsize=15
         self.a.tick_params(axis='x', labelsize=labelsize)
         self.a.tick_params(axis='y', labelsize=labelsize)
         if logscale_x:
             self.a.set_xlabel('Log(' +str(x_label)+')', fontsize=labelsize)
-            self.a.set_ylabel('Count', fontsize=labelsize)
-            if len(subset_list) > 1:
-                for i in range(len(subset_list)):
-                    col[i] *= np.sign(np.average(col[i]))
-                    col[i] = np.log10(col[i])
-                    y, x, patches = self.a.hist(col[i],bins=int(numbins),log=bool(logscale_y),histtype='step',stacked=False,fill=False,label=subset_list[i])
-                    self.xdata.append(x)
-                    self.ydata.append(y)
-            else:
-                col *= np.sign(np.average(col))
-                col = np.log10(col)
-                self.ydata, self.xdata, patches = self.a.hist(col,bins=int(numbins),log=bool(logscale_y),histtype='step',stacked=False,fill=False,label=subset_list)
         else:
             self.a.set_xlabel(x_label, fontsize=labelsize)
-            self.a.set_ylabel('Count', fontsize=labelsize)
-            if len(subset_list) > 1:
-                for i in range(len(subset_list)):
-                    if x_label == 'Fold Fraction':
-                        y, self.xdata, patches = self.a.hist(col[i],range=(0,0.5),bins=(0,0.1,0.2,0.3,0.4,0.5),log=bool(logscale_y),histtype='step',stacked=False,fill=False,label=subset_list[i])
-                        self.ydata.append(y)
-                    else:
-                        y, x, patches = self.a.hist(col[i],bins=int(numbins),log=bool(logscale_y),histtype='step',stacked=False,fill=False,label=subset_list[i])
-                        self.xdata.append(x)
-                        self.ydata.append(y)
-            else:
-                if x_label == 'Fold Fraction':
-                    self.ydata, self.xdata, patches = self.a.hist(col,range=(0,0.5),bins=(0,0.1,0.2,0.3,0.4,0.5),log=bool(logscale_y),histtype='step',stacked=False,fill=False,label=subset_list)
-                else:
-                    self.ydata, self.xdata, patches = self.a.hist(col,bins=int(numbins),log=bool(logscale_y),histtype='step',stacked=False,fill=False,label=subset_list)
+        self.a.set_ylabel('Count', fontsize=labelsize)
+        ##only the cached counts are drawn, one weighted point per bin
+        for subset, y in zip(subset_list, counts):
+            self.a.hist(edges[:-1],bins=edges,weights=y,log=bool(logscale_y),histtype='step',stacked=False,fill=False,label=subset)
         self.a.legend(loc='best',prop={'size': 10})
-        
-        
-        for i in range(len(subset_list)):
-            try:
-                self.xdata[i] = self.xdata[i][:-1] + np.diff(self.xdata[i])/2.0
-            except IndexError:
-                self.xdata = self.xdata[:-1] + np.diff(self.xdata)/2.0
+
+        centers = edges[:-1] + np.diff(edges)/2.0
+        if len(subset_list) > 1:
+            self.xdata = [centers for subset in subset_list]
+            self.ydata = list(counts)
+        else:
+            self.xdata = centers
+            self.ydata = counts[0]
         self.canvas.draw()
         self.canvas.callbacks.connect('button_press_event', self.on_click)
 
-        
+    def compute_2d_histogram(self, x_col, y_col, subset, xbins, ybins, logscale_x, logscale_y):
+        x = self.histogram_column(x_col, subset, logscale_x)
+        y = self.histogram_column(y_col, subset, logscale_y)
+        if len(x) != len(y):
+            raise AttributeError('X and Y must have the same length')
+        xedges = shared_edges([x], xbins)
+        yedges = shared_edges([y], ybins)
+        return histogram2d(x, y, xedges, yedges), xedges, yedges
+
     def plot_2d_histogram(self):
         subset = self.subset_option.cget('text')
         self.export_type = 'hist2d'
@@ -1229,10 +1406,13 @@ class App(tk.Frame):
         logscale_y = self.y_log_var.get()
         x_label = self.x_option.cget('text')
         y_label = self.y_option.cget('text')
-        x_col = np.squeeze(np.array(self.parse_db_col(self.unalias_dict.get(x_label,x_label),subset)))
-        y_col = np.squeeze(np.array(self.parse_db_col(self.unalias_dict.get(y_label,y_label),subset)))
-        xbins = self.xbin_entry.get()
-        ybins = self.ybin_entry.get()
+        x_col = self.unalias_dict.get(x_label,x_label)
+        y_col = self.unalias_dict.get(y_label,y_label)
+        xbins = int(self.xbin_entry.get())
+        ybins = int(self.ybin_entry.get())
+        db = self.eventsdb_subset[subset]
+        key = self.histogram_key('hist2d', x_col, y_col, xbins, ybins, bool(logscale_x), bool(logscale_y), subset, db.column_version(x_col), db.column_version(y_col))
+        z, x, y = self.histogram_cache.get(key, lambda: self.compute_2d_histogram(x_col, y_col, subset, xbins, ybins, logscale_x, logscale_y))
         self.f.clf()
         self.a = self.f.add_subplot(111)
         labelsize=15
@@ -1244,20 +1424,13 @@ class App(tk.Frame):
             self.a.set_ylabel('Log(' +str(y_label)+')', fontsize=labelsize)
         self.a.tick_params(axis='x', labelsize=labelsize)
         self.a.tick_params(axis='y', labelsize=labelsize)
-        xsign = np.sign(np.average(x_col))
-        ysign = np.sign(np.average(y_col))
-        x = np.log10(xsign*x_col) if bool(logscale_x) else x_col
-        y = np.log10(ysign*y_col) if bool(logscale_y) else y_col
 
-        z, x, y, image = self.a.hist2d(x,y,bins=[int(xbins),int(ybins)],norm=matplotlib.colors.LogNorm())
+        self.a.pcolormesh(x, y, z.T, norm=matplotlib.colors.LogNorm())
         x = x[:-1] + np.diff(x)/2.0
         y = y[:-1] + np.diff(y)/2.0
-        xy = [list(zip([a]*len(y),y)) for a in x]
-        z = np.ravel(z)
-        xy = np.reshape(xy,(len(z),2))
-        self.xdata = xy[:,0]
-        self.ydata = xy[:,1]
-        self.zdata = z
+        self.xdata = np.repeat(x, len(y))
+        self.ydata = np.tile(y, len(x))
+        self.zdata = np.ravel(z)
         self.canvas.draw()
         
 
@@ -1295,13 +1468,10 @@ class App(tk.Frame):
             pass
 
     def parse_db_col(self, col, subset):
-        if col in ['blockages_pA','level_current_pA','level_duration_us','stdev_pA']:
-            if self.include_baseline.get():
-                return_col = np.hstack([np.array(a,dtype=float) for a in self.eventsdb_subset[subset][col].str.split(';')])
-            else:
-                return_col = np.hstack([np.array(a,dtype=float)[1:-1] for a in self.eventsdb_subset[subset][col].str.split(';')])
+        if col in self.ragged:
+            return_col = self.ragged[col].select(self.eventsdb_subset[subset].rows, bool(self.include_baseline.get()))
         else:
-            return_col = self.eventsdb_subset[subset][col]
+            return_col = self.eventsdb_subset[subset].col(col)
         
         return return_col.astype(np.float64)
 
@@ -1313,22 +1483,17 @@ class App(tk.Frame):
         subset = self.subset_option.cget('text')
         ratedb = self.ratedb
         index = self.event_index.get()
-        if any(self.eventsdb_subset[subset]['id']==index) or self.plot_bad_events.get():
-            try:
-                event_file_path = self.events_folder+'/event_%05d.csv' % index
-                event_file = pd.read_csv(event_file_path,encoding='utf-8')
-            except IOError:
-                try:
-                    event_file_path = self.events_folder+'/event_%08d.csv' % index
-                    event_file = pd.read_csv(event_file_path,encoding='utf-8')
-                except IOError:
-                    self.event_info_string.set(event_file_path+' not found')
-                    return
-            eventsdb_subset = self.eventsdb_subset[subset]
+        in_subset = self.eventsdb_subset[subset].has_id(index)
+        if in_subset or self.plot_bad_events.get():
+            event_file = self.load_event_trace(index)
+            if event_file is None:
+                self.event_info_string.set('Event {0} trace not found in {1}'.format(index, self.events_folder))
+                return
+            event_file = event_file.copy(deep=False)
             self.event_export_file = event_file
-            try:
-                event_type = sqldf('SELECT type from eventsdb_subset WHERE id=%d' % index,locals())['type'][0]
-            except IndexError:
+            if in_subset:
+                event_type = self.eventsdb_subset[subset].value('type', index)
+            else:
                 event_type = 0
             self.event_export_type = event_type
             if event_type == 0:
@@ -1337,9 +1502,8 @@ class App(tk.Frame):
                 event_file.columns = ['time','current','cusum','stepfit']
             if ratedb is not None:
                 try:
-                    crossings = self.parse_list(sqldf('SELECT intra_crossing_times_us from ratedb WHERE id=%d' % index,locals()).values)
-                    local_stdev = np.squeeze(sqldf('SELECT local_stdev from ratedb WHERE id=%d' % index,locals()).values)
-                    local_baseline = np.squeeze(sqldf('SELECT local_baseline from ratedb WHERE id=%d' % index,locals()).values)
+                    crossings, local_stdev, local_baseline = self.sql_session.rate_row(index, ['intra_crossing_times_us','local_stdev','local_baseline'])
+                    crossings = self.parse_list(crossings)
                     crossings = zip(crossings[::2], crossings[1::2])
                 except:
                     ratedb = None
@@ -1366,10 +1530,64 @@ class App(tk.Frame):
                 for start, end in crossings:
                     a.axvspan(start,end,color='g',alpha=0.3)
             self.event_canvas.draw()
-            self.event_info_string.set('Successfully plotted event {0}'.format(index))
+            self.event_info_string.set('Successfully plotted event {0}\n{1}'.format(index, self.trace_cache.stats()))
+            self.prefetch_neighbours(index)
         else:
             self.event_info_string.set('Event {0} is missing or deleted'.format(index))
 
+    def read_event_trace(self, index):
+        ##called from the prefetch thread, so this must not touch any Tk widgets
+        if self.event_traces is not None and index in self.event_traces:
+            return self.event_traces.get(index)
+        try:
+            event_file_path = self.events_folder+'/event_%05d.csv' % index
+            event_file = pd.read_csv(event_file_path,encoding='utf-8')
+        except IOError:
+            try:
+                event_file_path = self.events_folder+'/event_%08d.csv' % index
+                event_file = pd.read_csv(event_file_path,encoding='utf-8')
+            except IOError:
+                return None
+        return event_file
+
+    def load_event_trace(self, index):
+        try:
+            self.trace_cache.budget = self.cache_mb.get()*2**20
+        except tk.TclError:
+            pass
+        return self.trace_cache.get(index)
+
+    def prefetch_neighbours(self, index):
+        try:
+            depth = self.prefetch_depth.get()
+        except tk.TclError:
+            return
+        if self.plot_bad_events.get():
+            following = list(range(index+1, min(index+depth, self.max_id)+1))
+            preceding = list(range(index-1, max(index-depth, 0)-1, -1))
+        else:
+            db = self.eventsdb_subset[self.subset_option.cget('text')]
+            following = []
+            preceding = []
+            a = index
+            while len(following) < depth:
+                a = db.next_id(a)
+                if a is None:
+                    break
+                following.append(a)
+            a = index
+            while len(preceding) < depth:
+                a = db.prev_id(a)
+                if a is None:
+                    break
+                preceding.append(a)
+        ##interleave so the nearest events in both directions are fetched first
+        order = [a for pair in itertools.zip_longest(following, preceding) for a in pair if a is not None]
+        self.trace_cache.prefetch(order)
+
+    def subset_changed(self):
+        self.trace_cache.clear()
+
     def export_event_data(self):
         data_path = tkinter.filedialog.asksaveasfilename(defaultextension='.csv')
         if self.event_export_type == 0:
@@ -1377,26 +1595,32 @@ class App(tk.Frame):
         elif self.event_export_type == 1:
             np.savetxt(data_path,np.c_[self.event_export_file['time'],self.event_export_file['current'],self.event_export_file['cusum'], self.event_export_file['stepfit']],delimiter=',')
 
+    def request_plot_event(self):
+        ##coalesce held arrow keys into one redraw per idle cycle
+        if self.pending_plot is None:
+            self.pending_plot = self.after_idle(self.draw_pending_event)
+
+    def draw_pending_event(self):
+        self.pending_plot = None
+        self.plot_event()
+
     def next_event(self):
         if not self.plot_bad_events.get():
             subset = self.subset_option.cget('text')
-            try:
-                current_index = self.eventsdb_subset[subset][self.eventsdb_subset[subset]['id'] == self.event_index.get()].index.tolist()[0]
-            except IndexError:
+            if not self.eventsdb_subset[subset].has_id(self.event_index.get()):
                 self.event_info_string.set('Event not found, resetting')
-                current_index = -1
-            if current_index < max(self.eventsdb['id']):
-                next_index = self.eventsdb_subset[subset][self.eventsdb_subset[subset]['id'] > self.event_index.get()].index.tolist()[0]
-                self.event_index.set(int(self.eventsdb_subset[subset]['id'][next_index]))
-                self.plot_event()
+            next_index = self.eventsdb_subset[subset].next_id(self.event_index.get())
+            if next_index is not None:
+                self.event_index.set(next_index)
+                self.request_plot_event()
             else:
                 pass
         else:
             current_index = self.event_index.get()
-            if current_index < max(self.eventsdb['id']):
+            if current_index < self.max_id:
                 next_index = current_index + 1
                 self.event_index.set(next_index)
-                self.plot_event()
+                self.request_plot_event()
             else:
                 pass
             
@@ -1404,18 +1628,12 @@ class App(tk.Frame):
     def prev_event(self):
         if not self.plot_bad_events.get():
             subset = self.subset_option.cget('text')
-            try:
-                current_index = self.eventsdb_subset[subset][self.eventsdb_subset[subset]['id'] == self.event_index.get()].index.tolist()[0]
-            except IndexError:
+            if not self.eventsdb_subset[subset].has_id(self.event_index.get()):
                 self.event_info_string.set('Event not found, resetting')
-                current_index = 1
-            if current_index > 0:
-                try:
-                    prev_index = self.eventsdb_subset[subset][self.eventsdb_subset[subset]['id'] < self.event_index.get()].index.tolist()[-1]
-                    self.event_index.set(int(self.eventsdb_subset[subset]['id'][prev_index]))
-                    self.plot_event()
-                except IndexError:
-                    pass
+            prev_index = self.eventsdb_subset[subset].prev_id(self.event_index.get())
+            if prev_index is not None:
+                self.event_index.set(prev_index)
+                self.request_plot_event()
             else:
                 pass
         else:
@@ -1423,34 +1641,34 @@ class App(tk.Frame):
             if current_index > 0:
                 next_index = current_index - 1
                 self.event_index.set(next_index)
-                self.plot_event()
+                self.request_plot_event()
             else:
                 pass
 
     def delete_event(self):
         subset = self.subset_option.cget('text')
         event_index = self.event_index.get()
-        try:
-            current_index = self.eventsdb_subset[subset][self.eventsdb_subset[subset]['id'] == self.event_index.get()].index.tolist()[0]
-        except IndexError:
+        db = self.eventsdb_subset[subset]
+        if not db.has_id(event_index):
             self.event_info_string.set('Event not found, resetting')
-            current_index = -1
-        if current_index < len(self.eventsdb_subset[subset])-1:
+        if db.next_id(event_index) is not None:
             self.next_event()
-        elif current_index > 0:
+        elif db.prev_id(event_index) is not None:
             self.prev_event()
-        else:
-            self.event_index.set(self.eventsdb_subset[subset]['id'][0])
-            self.plot_event()
-        eventsdb_subset = self.eventsdb_subset[subset]
-        self.eventsdb_subset[subset] = sqldf('SELECT * from eventsdb_subset WHERE id != %d' % event_index,locals())
-        self.status_string.set('{0}: {1} events'.format(subset,len(self.eventsdb_subset[subset])))
-
-        if 'id != {0}'.format(event_index) not in self.filter_list[subset]:
+        elif len(db) > 0:
+            self.event_index.set(db.ids()[0])
+            self.request_plot_event()
+        row = find_sorted(self.eventsdb['id'].values, event_index)
+        if db.has_id(event_index):
+            values = db.overlay_values(event_index)
+            db.remove_id(event_index)
+            ##the id was still in the subset, so its filter string cannot be in the list yet
             self.filter_list[subset].append('id != {0}'.format(event_index))
+            self.history.push(Deletion(subset, event_index, row, values, bool(self.manual_delete[row])))
+        self.status_string.set('{0}: {1} events'.format(subset,len(db)))
 
-        if event_index not in self.manual_delete:
-            self.manual_delete.append(event_index)
+        if row >= 0:
+            self.manual_delete[row] = True
 
 
     def right_key_press(self, event):
@@ -1487,6 +1705,7 @@ class App(tk.Frame):
                       'n_levels': 'Number of Levels',
                       'intra_crossings': 'Intra-Event Threshold Crossings',
                       'cluster_id': 'Cluster ID',
+                      'cluster_probability': 'Cluster Probability',
                       'rc_const1_us': 'RC Constant 1 (us)',
                       'rc_const2_us': 'RC Constant 2 (us)',
                       'level_current_pA': 'Level Current (pA)',
@@ -1511,15 +1730,76 @@ class App(tk.Frame):
     def save_subset(self):
         subset = self.subset_option.cget('text')
         folder = os.path.dirname(os.path.abspath(self.file_path_string))
-        subset_file_path = folder + '\eventsdb-{0}.csv'.format(subset)
-        subset_file = open(subset_file_path,'w')
+        subset_file_path = folder + '\eventsdb-{0}{1}'.format(subset, self.subset_format.get())
         filter_file_path = folder + '\eventsdb-{0}-filters.txt'.format(subset)
+        db = self.eventsdb_subset[subset]
+        start = time.perf_counter()
+        try:
+            write_subset(subset_file_path, db, self.ragged)
+        except ImportError:
+            self.status_string.set('Parquet and Feather export need pyarrow')
+            return
+        elapsed = time.perf_counter() - start
         filter_file = open(filter_file_path,'w')
-        self.eventsdb_subset[subset].to_csv(subset_file,index=False)
         for item in self.filter_list[subset]:
             filter_file.write('{0}\n'.format(item))
-        subset_file.close()
         filter_file.close()
+        size = os.path.getsize(subset_file_path)/2.0**20
+        self.status_string.set('Saved {0} events to {1} in {2:.2f} s ({3:.0f} MB, {4:.0f} MB/s)'.format(len(db), subset_file_path, elapsed, size, size/max(elapsed,1e-9)))
+
+    def save_session(self):
+        folder = os.path.dirname(os.path.abspath(self.file_path_string))
+        session_path = tkinter.filedialog.asksaveasfilename(initialdir=folder, initialfile='eventsdb-session.npz', defaultextension='.npz', filetypes=[('Session','*.npz')])
+        if not session_path:
+            return
+        subsets = OrderedDict(self.eventsdb_subset.items())
+        for key, val in self.capture_rate_subset.items():
+            if val is not None:
+                subsets['Capture Rate '+key] = val
+        stat = os.stat(self.file_path_string)
+        meta = {'source_sha256': source_hash(self.file_path_string),
+                'source_size': stat.st_size,
+                'source_mtime_ns': stat.st_mtime_ns,
+                'filter_list': self.filter_list,
+                'good_event_subset': self.good_event_subset,
+                'num_states': getattr(self, 'num_states', None)}
+        arrays = {'manual_delete': self.manual_delete}
+        if hasattr(self, 'state_array'):
+            arrays['state_array'] = self.state_array
+        save_session(session_path, self.eventsdb, meta, subsets, arrays)
+        self.status_string.set('Session saved to {0}'.format(session_path))
+
+    def load_session(self):
+        folder = os.path.dirname(os.path.abspath(self.file_path_string))
+        session_path = tkinter.filedialog.askopenfilename(initialdir=folder, filetypes=[('Session','*.npz')])
+        if not session_path:
+            return
+        start = time.perf_counter()
+        try:
+            meta, subsets, arrays = load_session(session_path, self.eventsdb)
+        except (OSError, ValueError, KeyError):
+            self.status_string.set('Unable to read session file')
+            return
+        ##an unchanged size and modification time stand for unchanged contents, as for the ragged cache, so the
+        ##source is only hashed when the file was touched since the session was saved
+        stat = os.stat(self.file_path_string)
+        if meta.get('source_size') != stat.st_size or meta.get('source_mtime_ns') != stat.st_mtime_ns:
+            if meta.get('source_sha256') != source_hash(self.file_path_string):
+                self.status_string.set('Session was saved for a different events database')
+                return
+        for key in self.eventsdb_subset:
+            self.eventsdb_subset[key] = subsets.get(key, Subset(self.eventsdb))
+            self.capture_rate_subset[key] = subsets.get('Capture Rate '+key)
+            self.filter_list[key] = list(meta['filter_list'].get(key, []))
+        self.good_event_subset = list(meta['good_event_subset'])
+        self.manual_delete = arrays['manual_delete']
+        self.history.clear()
+        if 'state_array' in arrays:
+            self.num_states = meta['num_states']
+            self.state_array = arrays['state_array']
+            self.clicks_remaining = 0
+        self.subset_changed()
+        self.status_string.set('Session restored in {0:.0f} ms'.format(1000*(time.perf_counter()-start)))
 
     def onclick(event):
         self.status_string.set('button=%d, x=%d, y=%d, xdata=%f, ydata=%f' % (event.button, event.x, event.y, event.xdata, event.ydata))
@@ -1535,12 +1815,20 @@ def main():
     folder = folder + '\events\\'
     root.wm_title(title)
     summary = open(summary, 'r')
-    eventsdb = pd.read_csv(file_path_string,encoding='utf-8')
+    set_plot_style()
+    start = time.perf_counter()
+    if os.path.splitext(file_path_string)[1].lower() in subset_extensions[1:]:
+        eventsdb, ragged = read_subset(file_path_string)
+    else:
+        eventsdb, ragged = read_eventsdb(file_path_string)
     try:
         ratedb = pd.read_csv(ratefile, encoding='utf-8')
     except:
         ratedb=None
-    App(root,eventsdb,ratedb,summary,folder,file_path_string).grid(row=0,column=0)
+    app = App(root,eventsdb,ratedb,summary,folder,file_path_string,ragged)
+    app.grid(row=0,column=0)
+    table_bytes, level_bytes = memory_usage(app.eventsdb, app.ragged)
+    app.status_string.set('Loaded {0} events in {1:.1f} s: {2:.0f} MB table, {3:.0f} MB levels'.format(len(app.eventsdb), time.perf_counter()-start, table_bytes/2.0**20, level_bytes/2.0**20))
     root.mainloop()
 
 if __name__=="__main__":
@@ -0,0 +1,150 @@
+##                                COPYRIGHT
+##    Copyright (C) 2015 Kyle Briggs (kbrig035<at>uottawa.ca)
+##
+##    This file is part of cusumtools.
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+##Headless version of readevents for applying a saved filter list to many eventsdb files. Usage:
+##    python readevents_batch.py eventsdb-Subset\ 1-filters.txt exp1/eventsdb.csv exp2/eventsdb.csv ...
+##Each file is filtered in its own process and written next to its input as eventsdb-<subset>.csv (or .parquet,
+##.feather, .npz with --format) with a copy of the filters, and one summary table with event counts, capture
+##rates and timings is written at the end.
+
+import os
+import re
+import sys
+import time
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from eventstable import read_eventsdb, prepare_eventsdb
+from columnar import write_subset, subset_extensions
+from subsets import Subset, replay_filters
+from capturerate import interevent_delays, mle_rate
+
+summary_columns = ['duration_us','average_blockage_pA','relative_average_blockage','max_blockage_pA','area_pC','n_levels']
+
+
+def read_filters(filter_path):
+    with open(filter_path,'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def subset_name(filter_path):
+    match = re.match(r'^eventsdb-(.+)-filters\.txt$', os.path.basename(filter_path))
+    return match.group(1) if match else 'batch'
+
+
+def output_paths(file_path_string, subset, output_folder=None, extension='.csv'):
+    folder = os.path.dirname(os.path.abspath(file_path_string))
+    prefix = ''
+    if output_folder is not None:
+        prefix = os.path.basename(folder) + '-'
+        folder = output_folder
+    return (os.path.join(folder, '{0}eventsdb-{1}{2}'.format(prefix, subset, extension)),
+            os.path.join(folder, '{0}eventsdb-{1}-filters.txt'.format(prefix, subset)))
+
+
+def summarize(db, capture_rate_db):
+    summary = OrderedDict()
+    summary['events'] = len(db)
+    delays, censored = interevent_delays(capture_rate_db, False)
+    summary['capture_rate_hz'] = mle_rate(delays, censored)
+    for col in summary_columns:
+        if col in db and len(db) > 0:
+            values = np.asarray(db.col(col), dtype=np.float64)
+            summary['{0}_mean'.format(col)] = np.nanmean(values)
+            summary['{0}_median'.format(col)] = np.nanmedian(values)
+            summary['{0}_std'.format(col)] = np.nanstd(values)
+    return summary
+
+
+def process_file(file_path_string, filters, subset, output_folder=None, extension='.csv'):
+    timings = OrderedDict()
+    start = time.perf_counter()
+    eventsdb, ragged = read_eventsdb(file_path_string)
+    eventsdb, ragged = prepare_eventsdb(eventsdb, file_path_string, ragged)
+    timings['load_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    db = Subset(eventsdb)
+    capture_rate_db = replay_filters(db, filters, ragged=ragged)
+    if capture_rate_db is None:
+        capture_rate_db = db
+    timings['filter_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    subset_file_path, filter_file_path = output_paths(file_path_string, subset, output_folder, extension)
+    write_subset(subset_file_path, db, ragged)
+    with open(filter_file_path,'w') as filter_file:
+        for item in filters:
+            filter_file.write('{0}\n'.format(item))
+    timings['write_s'] = time.perf_counter() - start
+
+    result = OrderedDict()
+    result['file'] = file_path_string
+    result['total_events'] = len(eventsdb)
+    result.update(summarize(db, capture_rate_db))
+    result.update(timings)
+    result['total_s'] = sum(timings.values())
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply a saved readevents filter list to many eventsdb files')
+    parser.add_argument('filters', help='filter file saved by readevents (eventsdb-<subset>-filters.txt)')
+    parser.add_argument('files', nargs='+', help='eventsdb csv files to filter')
+    parser.add_argument('--subset', default=None, help='name used for the output files, taken from the filter file by default')
+    parser.add_argument('--output', default=None, help='write all outputs to this folder instead of next to each input')
+    parser.add_argument('--summary', default=None, help='summary csv path, batch-summary-<subset>.csv by default')
+    parser.add_argument('--format', default='csv', choices=[ext[1:] for ext in subset_extensions], help='subset file format, csv by default')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes, one per cpu by default')
+    args = parser.parse_args()
+
+    filters = read_filters(args.filters)
+    subset = args.subset if args.subset is not None else subset_name(args.filters)
+    if args.output is not None and not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    summary_path = args.summary
+    if summary_path is None:
+        summary_path = os.path.join(args.output if args.output is not None else os.getcwd(), 'batch-summary-{0}.csv'.format(subset))
+    workers = min(args.workers or os.cpu_count() or 1, len(args.files))
+
+    start = time.perf_counter()
+    results = OrderedDict()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = dict((pool.submit(process_file, f, filters, subset, args.output, '.'+args.format), f) for f in args.files)
+        for future in as_completed(futures):
+            f = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                print('{0}: failed ({1})'.format(f, e))
+                continue
+            results[f] = result
+            print('{0}: {1} of {2} events kept, load {3:.2f} s, filter {4:.2f} s, write {5:.2f} s'.format(f, result['events'], result['total_events'], result['load_s'], result['filter_s'], result['write_s']))
+
+    summary = pd.DataFrame([results[f] for f in args.files if f in results])
+    summary.to_csv(summary_path, index=False)
+    print('Processed {0} of {1} files with {2} workers in {3:.2f} s, summary written to {4}'.format(len(results), len(args.files), workers, time.perf_counter()-start, summary_path))
+    if failed:
+        sys.exit(1)
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,78 @@
+##                                COPYRIGHT
+##    Copyright (C) 2015 Kyle Briggs (kbrig035<at>uottawa.ca)
+##
+##    This file is part of cusumtools.
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+from collections import OrderedDict
+import numpy as np
+from subsets import Subset
+
+session_version = 1
+
+
+def save_session(path, master, meta, subsets, arrays):
+    ##subset membership is stored as a bitmap over the rows of the master table, next to the columns each
+    ##subset has set itself, and boolean arrays are bit packed the same way. everything else goes in meta
+    meta = dict(meta)
+    meta['version'] = session_version
+    meta['num_events'] = len(master)
+    meta['subsets'] = OrderedDict()
+    meta['bitmaps'] = dict()
+    out = OrderedDict()
+    for i, (name, db) in enumerate(subsets.items()):
+        members = np.zeros(len(master), dtype=bool)
+        members[db.rows] = True
+        out['subset{0}'.format(i)] = np.packbits(members)
+        overlay = db.overlay
+        for j, val in enumerate(overlay.values()):
+            out['subset{0}_column{1}'.format(i,j)] = np.asarray(val)
+        meta['subsets'][name] = list(overlay.keys())
+    for name, val in arrays.items():
+        val = np.asarray(val)
+        if val.dtype == bool:
+            meta['bitmaps'][name] = len(val)
+            val = np.packbits(val)
+        out['array_'+name] = val
+    out['meta'] = np.array(json.dumps(meta))
+    with open(path,'wb') as f:
+        np.savez(f, **out)
+
+
+def load_session(path, master):
+    with np.load(path, allow_pickle=False) as f:
+        meta = json.loads(str(f['meta']))
+        if meta.get('version') != session_version:
+            raise ValueError('{0} is not a session file'.format(path))
+        if meta['num_events'] != len(master):
+            raise ValueError('{0} was saved for a database of {1} events'.format(path, meta['num_events']))
+        subsets = OrderedDict()
+        for i, (name, columns) in enumerate(meta['subsets'].items()):
+            rows = np.flatnonzero(np.unpackbits(f['subset{0}'.format(i)], count=len(master)))
+            db = Subset(master, rows)
+            for j, col in enumerate(columns):
+                db.set_col(col, f['subset{0}_column{1}'.format(i,j)])
+            subsets[name] = db
+        arrays = dict()
+        for key in f.files:
+            if key.startswith('array_'):
+                name = key[len('array_'):]
+                val = f[key]
+                if name in meta['bitmaps']:
+                    val = np.unpackbits(val, count=meta['bitmaps'][name]).astype(bool)
+                arrays[name] = val
+    return meta, subsets, arrays
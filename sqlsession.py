@@ -0,0 +1,101 @@
+##                                COPYRIGHT
+##    Copyright (C) 2015 Kyle Briggs (kbrig035<at>uottawa.ca)
+##
+##    This file is part of cusumtools.
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import sqlite3
+from collections import OrderedDict
+import numpy as np
+from ragged import list_columns
+
+sql_prefix = 'SQL: '
+indexed_columns = ['id','start_time_s','type']
+max_subset_tables = 16
+
+
+def quote(name):
+    return '"{0}"'.format(name.replace('"','""'))
+
+
+class SqlSession(object):
+    ##one in-memory sqlite database per session. the events and rate tables are loaded once, on first use,
+    ##and a subset is a temp table of its ids plus its own columns, built when a clause needs those columns
+    def __init__(self, eventsdb, ratedb=None):
+        self.eventsdb = eventsdb
+        self.ratedb = ratedb
+        self.conn = sqlite3.connect(':memory:')
+        self.event_columns = None
+        self.rate_columns = None
+        self.tables = OrderedDict()
+
+    def load_events(self):
+        if self.event_columns is None:
+            self.event_columns = [col for col in self.eventsdb.columns if col not in list_columns]
+            self.eventsdb[self.event_columns].to_sql('events', self.conn, index=False)
+            for col in indexed_columns:
+                if col in self.event_columns:
+                    self.conn.execute('CREATE INDEX {0} ON events ({1})'.format(quote('events_'+col), quote(col)))
+
+    def load_rates(self):
+        if self.rate_columns is None:
+            self.rate_columns = list(self.ratedb.columns) if self.ratedb is not None else []
+            if self.ratedb is not None:
+                self.ratedb.to_sql('rate', self.conn, index=False)
+                if 'id' in self.rate_columns:
+                    self.conn.execute('CREATE INDEX rate_id ON rate (id)')
+
+    def subset_table(self, db):
+        name = self.tables.get(db.version)
+        if name is not None:
+            self.tables.move_to_end(db.version)
+            return name
+        name = 'subset_{0}'.format(db.version)
+        overlay = [col for col in db.overlay if col != 'id']
+        self.conn.execute('CREATE TEMP TABLE {0} (id INTEGER PRIMARY KEY{1})'.format(name, ''.join(', '+quote(col) for col in overlay)))
+        values = [db.ids().tolist()] + [np.asarray(db.col(col)).tolist() for col in overlay]
+        self.conn.executemany('INSERT INTO {0} VALUES ({1})'.format(name, ', '.join(['?']*len(values))), zip(*values))
+        self.tables[db.version] = name
+        while len(self.tables) > max_subset_tables:
+            self.conn.execute('DROP TABLE {0}'.format(self.tables.popitem(last=False)[1]))
+        return name
+
+    def where(self, db, clause):
+        ##boolean mask over the subset for the events matching an SQL WHERE clause. clauses that only use master
+        ##columns run straight against the indexed events table, the subset temp table is only joined when the
+        ##clause needs one of the subset's own columns
+        self.load_events()
+        tokens = set(re.findall(r'[A-Za-z_][A-Za-z0-9_]*', clause))
+        overlay = [col for col in db.overlay if col != 'id']
+        if any(col in tokens for col in overlay):
+            name = self.subset_table(db)
+            columns = ['s.id'] + ['e.'+quote(col) for col in self.event_columns if col != 'id' and col not in overlay] + ['s.'+quote(col) for col in overlay]
+            query = 'SELECT id FROM (SELECT {0} FROM {1} s JOIN events e ON e.id = s.id) WHERE {2}'.format(', '.join(columns), name, clause)
+        else:
+            query = 'SELECT id FROM events WHERE {0}'.format(clause)
+        ids = np.fromiter((row[0] for row in self.conn.execute(query)), dtype=np.int64)
+        return np.isin(db.ids(), ids)
+
+    def rate_row(self, event_id, columns):
+        self.load_rates()
+        missing = [col for col in columns if col not in self.rate_columns]
+        if missing:
+            raise KeyError(missing[0])
+        query = 'SELECT {0} FROM rate WHERE id = ?'.format(', '.join(quote(col) for col in columns))
+        row = self.conn.execute(query, (int(event_id),)).fetchone()
+        if row is None:
+            raise KeyError(event_id)
+        return row
@@ -0,0 +1,315 @@
+##                                COPYRIGHT
+##    Copyright (C) 2015 Kyle Briggs (kbrig035<at>uottawa.ca)
+##
+##    This file is part of cusumtools.
+##
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import itertools
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from sqlsession import SqlSession, sql_prefix
+from ragged import segment_reducers
+
+
+versions = itertools.count(1)
+nonconsecutive_filter = 'Nonconsecutive Events Removed'
+deletion_pattern = re.compile(r'^id != (-?\d+)$')
+level_functions = ['any','all','first','last','count','sum','mean','max','min','length']
+level_function_pattern = re.compile(r'\b({0})\s*\('.format('|'.join(level_functions)))
+
+
+def query_columns(filterstring, columns):
+    tokens = set(re.findall(r'[A-Za-z_][A-Za-z0-9_]*', filterstring))
+    return [col for col in columns if col in tokens]
+
+
+def find_sorted(ids, event_id):
+    i = np.searchsorted(ids, event_id)
+    if i < len(ids) and ids[i] == event_id:
+        return int(i)
+    return -1
+
+
+def level_expressions(filterstring, list_columns):
+    ##splits any(...), first(...) and the other reductions over list columns out of a filter string, so that
+    ##any(blockages_pA > 500) & first(level_duration_us) > 20 becomes @_level0 & @_level1 > 20
+    expressions = []
+    parts = []
+    pos = 0
+    for match in level_function_pattern.finditer(filterstring):
+        if match.start() < pos:
+            continue
+        depth = 1
+        end = match.end()
+        while end < len(filterstring) and depth > 0:
+            depth += {'(': 1, ')': -1}.get(filterstring[end], 0)
+            end += 1
+        if depth > 0:
+            raise SyntaxError('Unbalanced parentheses in {0}'.format(filterstring))
+        inner = filterstring[match.end():end-1]
+        if len(query_columns(inner, list_columns)) == 0:
+            continue
+        name = '_level{0}'.format(len(expressions))
+        parts.append(filterstring[pos:match.start()])
+        parts.append('@'+name)
+        expressions.append((name, match.group(1), inner))
+        pos = end
+    parts.append(filterstring[pos:])
+    return ''.join(parts), expressions
+
+
+def level_reduce(db, ragged, function, expression):
+    ##evaluates expression once over the flat levels of every event in the subset, baseline levels excluded,
+    ##with event columns repeated onto their levels, then reduces each event's segment to one value
+    list_cols = query_columns(expression, list(ragged))
+    rows = db.rows
+    first = ragged[list_cols[0]]
+    lengths = first.offsets[rows+1] - first.offsets[rows]
+    for col in list_cols[1:]:
+        if np.any(ragged[col].offsets[rows+1] - ragged[col].offsets[rows] != lengths):
+            raise ValueError('{0} and {1} have different numbers of levels'.format(list_cols[0], col))
+    index = first.level_index(rows, include_baseline=False)
+    lengths = np.maximum(lengths - 2, 0)
+    offsets = np.zeros(len(rows)+1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    levels = OrderedDict((col, np.asarray(ragged[col].values)[index]) for col in list_cols)
+    for col in query_columns(expression, [col for col in db.columns if col not in ragged]):
+        levels[col] = np.repeat(db.col(col), lengths)
+    values = np.broadcast_to(np.asarray(pd.DataFrame(levels).eval(expression)), (len(index),))
+    return segment_reducers[function](values, offsets)
+
+
+class Subset(object):
+    ##sorted row positions into the master events table, plus per-subset columns aligned with those rows.
+    ##single deletions only mark a tombstone, and the arrays are compacted once a quarter of them are dead
+    ##or when something needs positional access, so deleting while browsing costs O(1) amortized
+    def __init__(self, master, rows=None):
+        self.master = master
+        if rows is None:
+            rows = np.arange(len(master), dtype=np.int64)
+        self._rows = np.asarray(rows, dtype=np.int64)
+        self._overlay = OrderedDict()
+        self.version = next(versions)
+        self.rows_version = self.version
+        self.col_versions = dict()
+        self._ids = None
+        self._alive = None
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._rows) - self._dead
+
+    def __contains__(self, col):
+        return col in self._overlay or col in self.master.columns
+
+    @property
+    def rows(self):
+        self._compact()
+        return self._rows
+
+    @property
+    def overlay(self):
+        self._compact()
+        return self._overlay
+
+    @property
+    def columns(self):
+        return list(self.master.columns) + [col for col in self._overlay if col not in self.master.columns]
+
+    def _compact(self):
+        if self._dead > 0:
+            alive = self._alive
+            self._rows = self._rows[alive]
+            for key, val in self._overlay.items():
+                self._overlay[key] = val[alive]
+            self._ids = self._ids[alive]
+            self._alive = None
+            self._dead = 0
+
+    def _raw_ids(self):
+        if self._ids is None:
+            self._ids = self._overlay['id'] if 'id' in self._overlay else self.master['id'].values[self._rows]
+        return self._ids
+
+    def _raw_position(self, event_id):
+        i = find_sorted(self._raw_ids(), event_id)
+        if i >= 0 and self._alive is not None and not self._alive[i]:
+            return -1
+        return i
+
+    def col(self, name):
+        self._compact()
+        if name in self._overlay:
+            return self._overlay[name]
+        return self.master[name].values[self._rows]
+
+    def column_version(self, name):
+        ##changes whenever the values returned by col(name) may have changed, unlike version which also
+        ##moves when any other column is set
+        return (self.rows_version, self.col_versions.get(name, 0))
+
+    def ids(self):
+        ##rows are sorted and the master table is sorted by id, so this is a sorted id index
+        self._compact()
+        return self._raw_ids()
+
+    def has_id(self, event_id):
+        return self._raw_position(event_id) >= 0
+
+    def value(self, name, event_id):
+        i = self._raw_position(event_id)
+        if i < 0:
+            raise KeyError(event_id)
+        if name in self._overlay:
+            return self._overlay[name][i]
+        return self.master[name].values[self._rows[i]]
+
+    def position(self, event_id):
+        self._compact()
+        return find_sorted(self._raw_ids(), event_id)
+
+    def next_id(self, event_id):
+        ids = self._raw_ids()
+        i = np.searchsorted(ids, event_id, side='right')
+        while i < len(ids) and self._alive is not None and not self._alive[i]:
+            i += 1
+        return int(ids[i]) if i < len(ids) else None
+
+    def prev_id(self, event_id):
+        ids = self._raw_ids()
+        i = np.searchsorted(ids, event_id, side='left') - 1
+        while i >= 0 and self._alive is not None and not self._alive[i]:
+            i -= 1
+        return int(ids[i]) if i >= 0 else None
+
+    def remove_id(self, event_id):
+        i = self._raw_position(event_id)
+        if i < 0:
+            return False
+        if self._alive is None:
+            self._alive = np.ones(len(self._rows), dtype=bool)
+        self._alive[i] = False
+        self._dead += 1
+        self.version = next(versions)
+        self.rows_version = self.version
+        if 4*self._dead > len(self._rows):
+            self._compact()
+        return True
+
+    def overlay_values(self, event_id):
+        ##this event's values in the per-subset columns, enough to put it back with insert
+        i = self._raw_position(event_id)
+        if i < 0:
+            raise KeyError(event_id)
+        return OrderedDict((key, val[i]) for key, val in self._overlay.items())
+
+    def insert(self, row, values):
+        self._compact()
+        i = np.searchsorted(self._rows, row)
+        self._rows = np.insert(self._rows, i, row)
+        for key, val in self._overlay.items():
+            self._overlay[key] = np.insert(val, i, values[key])
+        self._ids = None
+        self.version = next(versions)
+        self.rows_version = self.version
+
+    def remove_ids(self, event_ids):
+        self.keep(~np.isin(self.ids(), event_ids))
+
+    def remove_nonconsecutive(self):
+        index_diff = np.insert(np.diff(self.ids()), 0, 0)
+        self.set_col('index_diff', index_diff)
+        self.keep(index_diff == 1)
+
+    def frame(self, columns=None):
+        if columns is None:
+            columns = self.columns
+        return pd.DataFrame(OrderedDict((col, self.col(col)) for col in columns), index=self.rows)
+
+    def set_col(self, name, values):
+        self._compact()
+        values = np.asarray(values)
+        if len(values) != len(self._rows):
+            raise ValueError('{0} has {1} values for {2} events'.format(name, len(values), len(self._rows)))
+        self._overlay[name] = values
+        if name == 'id':
+            self._ids = None
+        self.version = next(versions)
+        self.col_versions[name] = self.version
+
+    def keep(self, mask):
+        self._compact()
+        self._rows = self._rows[mask]
+        for key, val in self._overlay.items():
+            self._overlay[key] = val[mask]
+        if self._ids is not None:
+            self._ids = self._ids[mask]
+        self.version = next(versions)
+        self.rows_version = self.version
+
+    def query(self, filterstring, ragged=None):
+        local_dict = dict()
+        if ragged:
+            filterstring, expressions = level_expressions(filterstring, list(ragged))
+            for name, function, expression in expressions:
+                local_dict[name] = level_reduce(self, ragged, function, expression)
+        frame = self.frame(query_columns(filterstring, self.columns))
+        mask = frame.eval(filterstring, local_dict=local_dict)
+        mask = np.broadcast_to(np.asarray(mask), (len(self),))
+        if mask.dtype != bool:
+            raise TypeError('Filter does not evaluate to True/False: {0}'.format(filterstring))
+        self.keep(mask)
+
+    def copy(self):
+        self._compact()
+        subset = Subset(self.master, self._rows)
+        subset._overlay = OrderedDict(self._overlay)
+        subset.version = self.version
+        subset.rows_version = self.rows_version
+        subset.col_versions = dict(self.col_versions)
+        subset._ids = self._ids
+        return subset
+
+
+def replay_filters(db, filters, session=None, ragged=None):
+    ##applies a saved filter list the way the GUI built it: queries renumber adj_id, 'id != N' entries are
+    ##manual deletions and are removed together, and the subset before non-consecutive removal is returned
+    ##for the capture rate
+    capture_rate_db = None
+    deleted = []
+    for filterstring in filters:
+        match = deletion_pattern.match(filterstring)
+        if match:
+            deleted.append(int(match.group(1)))
+            continue
+        if deleted:
+            db.remove_ids(deleted)
+            deleted = []
+        if filterstring == nonconsecutive_filter:
+            capture_rate_db = db.copy()
+            db.remove_nonconsecutive()
+        elif filterstring.startswith(sql_prefix):
+            if session is None:
+                session = SqlSession(db.master)
+            db.keep(session.where(db, filterstring[len(sql_prefix):]))
+            db.set_col('adj_id', np.arange(0,len(db)))
+        else:
+            db.query(filterstring, ragged)
+            db.set_col('adj_id', np.arange(0,len(db)))
+    if deleted:
+        db.remove_ids(deleted)
+    return capture_rate_db